@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Throughput benchmark of copr_bridge.py against the in-process fake COPR
+# of fake_copr.py. Reports SRPMs/hour, API calls per build and end-to-end
+# latency (from an SRPM being available until the bridge sees its build
+# result) for scan and watch mode at several SRPM directory sizes.
+# --
+import argparse
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+import copr_bridge
+from fake_copr import FakeClient, write_srpm
+
+# Interval at which the watch mode feeder checks for finished builds
+FEEDER_CHECK_SECONDS = 0.05
+
+# Result table layout
+HEADER = "%-5s  %6s  %8s  %10s  %11s  %11s  %11s  %11s" % (
+    "mode",
+    "srpms",
+    "seconds",
+    "srpms/hour",
+    "calls/build",
+    "latency p50",
+    "latency p95",
+    "latency max",
+)
+ROW = "%-5s  %6d  %8.1f  %10.0f  %11.2f  %11.1f  %11.1f  %11.1f"
+
+
+def bridge_args(srpm_dir, state_file, mode, options):
+    """Return the copr_bridge.py options of one benchmark run."""
+    return argparse.Namespace(
+        srpm_dir=srpm_dir,
+        copr_project="bench/project",
+        chroots=[],
+        state_file=state_file,
+        mode=mode,
+        skip_pattern=[],
+        include_pattern=[],
+        reset_failed=None,
+        ignore_errors=True,
+        force_rebuild=False,
+        dryrun=False,
+        poll_interval=options.poll_interval,
+        max_inflight=options.max_inflight,
+        schedule="mtime",
+        history_refresh=3600,
+        retention_days=None,
+        retention_releases=None,
+        srpm_base_url=None,
+        metrics_port=None,
+        metrics_file=None,
+        config=None,
+        copr_config=None,
+        debug=options.debug,
+    )
+
+
+def add_srpms(srpm_dir, count, options, available):
+    """Write count SRPMs, options.interval apart, noting when each appeared."""
+    for number in range(count):
+        srpm_name = "bench-pkg%05d-1.0-1.src.rpm" % number
+        write_srpm(
+            os.path.join(srpm_dir, srpm_name),
+            "bench-pkg%05d" % number,
+            "1.0",
+            "1",
+            size=options.srpm_size,
+        )
+        available[srpm_name] = time.time()
+        if options.interval:
+            time.sleep(options.interval)
+
+
+def feed_watch(srpm_dir, count, options, available, client):
+    """Feed SRPMs to a watching bridge, stop it once all builds finished."""
+    add_srpms(srpm_dir, count, options, available)
+    while sum(1 for b in client.builds.values() if b.observed) < count:
+        time.sleep(FEEDER_CHECK_SECONDS)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def percentile(values, fraction):
+    return values[round(fraction * (len(values) - 1))]
+
+
+def run(mode, count, options):
+    """Bridge count SRPMs in the given mode, return the values of a ROW."""
+    client = FakeClient(
+        duration=options.duration,
+        queue_seconds=options.queue_time,
+        failure_rate=options.failure_rate,
+        latency=options.latency,
+        seed=options.seed,
+    )
+    available = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        srpm_dir = os.path.join(tmp, "srpms")
+        os.mkdir(srpm_dir)
+        args = bridge_args(srpm_dir, os.path.join(tmp, "state.json"), mode, options)
+        bridge = copr_bridge.CoprBridge(args, client)
+
+        if mode == "scan":
+            add_srpms(srpm_dir, count, options, available)
+            started = time.time()
+            available = dict.fromkeys(available, started)
+            bridge.run_scan()
+        else:
+            started = time.time()
+            feeder = threading.Thread(
+                target=feed_watch,
+                args=(srpm_dir, count, options, available, client),
+                daemon=True,
+            )
+            feeder.start()
+            bridge.run_watch()
+        bridge.save_state()
+        bridge.close()
+
+    finished = {b.filename: b.observed for b in client.builds.values() if b.observed}
+    if not finished:
+        logging.error("No builds finished in %s mode with %d SRPMs", mode, count)
+        return None
+    seconds = max(finished.values()) - started
+    latencies = sorted(finished[n] - available[n] for n in finished)
+    return (
+        mode,
+        count,
+        seconds,
+        len(finished) / seconds * 3600,
+        sum(client.calls.values()) / len(client.builds),
+        percentile(latencies, 0.5),
+        percentile(latencies, 0.95),
+        latencies[-1],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark copr_bridge.py against an in-process fake COPR",
+    )
+    parser.add_argument(
+        "--sizes",
+        default="10,100,500",
+        help="comma-separated numbers of SRPMs to bridge (default: 10,100,500)",
+        type=str,
+    )
+    parser.add_argument(
+        "--modes",
+        default="scan,watch",
+        help="comma-separated modes to benchmark (default: scan,watch)",
+        type=str,
+    )
+    parser.add_argument(
+        "--duration",
+        default=2,
+        help="seconds each fake build runs (default: 2)",
+        type=float,
+    )
+    parser.add_argument(
+        "--queue-time",
+        default=1,
+        help="seconds each fake build waits for a builder (default: 1)",
+        type=float,
+    )
+    parser.add_argument(
+        "--failure-rate",
+        default=0,
+        help="probability that a fake build fails (default: 0)",
+        type=float,
+    )
+    parser.add_argument(
+        "--latency",
+        default=0.01,
+        help="seconds each fake COPR API call takes (default: 0.01)",
+        type=float,
+    )
+    parser.add_argument(
+        "--interval",
+        default=0,
+        help="seconds between SRPMs appearing in the directory (default: 0)",
+        type=float,
+    )
+    parser.add_argument(
+        "--srpm-size",
+        default=0,
+        help="payload bytes per SRPM (default: 0)",
+        type=int,
+    )
+    parser.add_argument(
+        "--max-inflight",
+        default=20,
+        help="maximum number of builds in flight at once (default: 20)",
+        type=int,
+    )
+    parser.add_argument(
+        "--poll-interval",
+        default=1,
+        help="seconds between build status polls (default: 1)",
+        type=float,
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        help="random seed for build failures (default: 0)",
+        type=int,
+    )
+    parser.add_argument(
+        "--debug",
+        dest="debug",
+        help="show the bridge's log output",
+        action="store_true",
+    )
+    options = parser.parse_args()
+
+    try:
+        sizes = [int(size) for size in options.sizes.split(",")]
+    except ValueError:
+        parser.error("--sizes must be comma-separated numbers")
+    modes = options.modes.split(",")
+    if not set(modes) <= {"scan", "watch"}:
+        parser.error("--modes must be scan, watch or both")
+
+    logging.basicConfig(
+        level=logging.DEBUG if options.debug else logging.ERROR,
+        format="%(message)s",
+    )
+
+    print(HEADER)
+    for mode in modes:
+        for count in sizes:
+            row = run(mode, count, options)
+            if row is not None:
+                print(ROW % row)
+                sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
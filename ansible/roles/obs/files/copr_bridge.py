@@ -1,33 +1,119 @@
 #!/usr/bin/env python3
 #
 # Utility to bridge OBS-built SRPMs to Fedora COPR for ppc64le builds.
-# Supports scan and watch modes for processing SRPMs serially.
+# Supports scan and watch modes, keeping a bounded number of builds in
+# flight (serially by default).
 # --
 import argparse
+import asyncio
+import gzip
+import hashlib
 import json
 import logging
+import mmap
+import multiprocessing
 import os
 import re
+import select
 import signal
+import socket
+import stat
 import struct
 import sys
+import threading
 import time
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from ctypes import CDLL, c_char_p, c_int, c_uint32, get_errno
 from ctypes.util import find_library
 from datetime import datetime, timezone
+from functools import cmp_to_key
+from http.client import HTTPException
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 import coloredlogs
 from copr.v3 import Client
-from copr.v3.exceptions import CoprAuthException, CoprException
+from copr.v3.exceptions import (
+    CoprAuthException,
+    CoprException,
+    CoprNoResultException,
+    CoprTimeoutException,
+)
 
 # Terminal build states from copr.v3
 TERMINAL_STATES = ("succeeded", "skipped", "failed", "canceled")
 
+# Build states from copr.v3 that can still turn into "succeeded"
+ACTIVE_STATES = ("importing", "pending", "starting", "running", "waiting")
+
 # Default retry settings for transient errors
 MAX_RETRIES = 5
 RETRY_BASE_SECONDS = 10
 
+# Longest wait before retrying a failed build with --max-attempts
+RETRY_BACKOFF_MAX_SECONDS = 4 * 3600
+
+# Longest sleep between checks for a shutdown request, as signals do not
+# interrupt sleeps
+SHUTDOWN_CHECK_SECONDS = 1
+
+# Default COPR API request rates per second by budget, the seconds of
+# requests a budget may burst, and the adaptation of the rates: halved on
+# throttling or server errors (down to the floor fraction of the default)
+# and raised by the step fraction of the default per successful request
+API_RATES = {"submit": 2.0, "status": 5.0, "history": 10.0}
+API_BURST_SECONDS = 10
+API_RATE_FLOOR = 1 / 16
+API_RATE_STEP = 1 / 20
+
+# Page size used when polling in-flight builds via the project build list
+POLL_PAGE_SIZE = 100
+
+# Poll intervals: while builds wait to start, the shortest and longest
+# interval for running builds with a known expected duration
+POLL_FAST_SECONDS = 10
+POLL_MIN_SECONDS = 5
+POLL_MAX_SECONDS = 900
+
+# Poll interval of in-flight builds while build state changes are notified,
+# as a safety net for lost notifications
+NOTIFY_POLL_SECONDS = 600
+
+# Number of recent build durations per package used to predict the next one
+DURATION_HISTORY = 5
+
+# Page size and number of concurrent requests used when fetching the
+# project build history
+HISTORY_PAGE_SIZE = 500
+HISTORY_WORKERS = 8
+
+# Minimum number of journal records before the state file is compacted
+COMPACT_MIN_RECORDS = 1000
+
+# State entry statuses that may be moved to the archive by the retention
+# policy; failed entries stay, as they drive retries and --reset-failed
+ARCHIVE_STATUSES = ("succeeded", "skipped")
+
+# Skip reasons of SRPMs built in COPR, though not by their own submission
+BUILT_REASONS = ("already-in-copr", "duplicate-content")
+
+# Number of SRPMs hashed concurrently and the amount hashed per update
+HASH_WORKERS = 4
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Number of processes validating SRPM headers and digests before queueing
+PREFLIGHT_WORKERS = 4
+
+# Timeout for checking that an SRPM is reachable under --srpm-base-url
+URL_CHECK_TIMEOUT = 10
+
+# Quiet period after the last inotify event for a file before it is queued
+INTAKE_DEBOUNCE_SECONDS = 0.5
+
 
 def ERROR(output):
     logging.error(output)
@@ -39,12 +125,218 @@ def now_iso():
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
 
 
+def sha256_file(path):
+    """Return the hex SHA-256 digest of a file, streamed through mmap."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, HASH_CHUNK_SIZE):
+                        digest.update(view[offset : offset + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def create_client(args):
+    """Create a COPR client from --copr-config or the default config file."""
+    config_path = getattr(args, "copr_config", None)
+    if config_path:
+        return Client.create_from_config_file(Path(config_path))
+    return Client.create_from_config_file()
+
+
+def rpmvercmp(a, b):
+    """Compare two version (or release) strings like rpm's rpmvercmp().
+
+    Returns 1 if a is newer, -1 if b is newer and 0 if they are equal.
+    """
+    if a == b:
+        return 0
+
+    def char(s, i):
+        return s[i] if i < len(s) else ""
+
+    def isdigit(c):
+        return "0" <= c <= "9"
+
+    def isalpha(c):
+        return "a" <= c <= "z" or "A" <= c <= "Z"
+
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while i < len(a) and not (isdigit(a[i]) or isalpha(a[i]) or a[i] in "~^"):
+            i += 1
+        while j < len(b) and not (isdigit(b[j]) or isalpha(b[j]) or b[j] in "~^"):
+            j += 1
+
+        # Tilde sorts before everything, even the end of the string
+        if char(a, i) == "~" or char(b, j) == "~":
+            if char(a, i) != "~":
+                return 1
+            if char(b, j) != "~":
+                return -1
+            i += 1
+            j += 1
+            continue
+
+        # Caret sorts after the end of the string, but before anything else
+        if char(a, i) == "^" or char(b, j) == "^":
+            if i == len(a):
+                return -1
+            if j == len(b):
+                return 1
+            if a[i] != "^":
+                return 1
+            if b[j] != "^":
+                return -1
+            i += 1
+            j += 1
+            continue
+
+        if i == len(a) or j == len(b):
+            break
+
+        # Compare the next numeric or alphabetic segment
+        isnum = isdigit(a[i])
+        same_kind = isdigit if isnum else isalpha
+        end_a, end_b = i, j
+        while end_a < len(a) and same_kind(a[end_a]):
+            end_a += 1
+        while end_b < len(b) and same_kind(b[end_b]):
+            end_b += 1
+        seg_a, seg_b = a[i:end_a], b[j:end_b]
+
+        # Numeric segments are newer than alphabetic ones
+        if not seg_b:
+            return 1 if isnum else -1
+
+        if isnum:
+            seg_a, seg_b = seg_a.lstrip("0"), seg_b.lstrip("0")
+            if len(seg_a) != len(seg_b):
+                return 1 if len(seg_a) > len(seg_b) else -1
+        if seg_a != seg_b:
+            return 1 if seg_a > seg_b else -1
+
+        i, j = end_a, end_b
+
+    if i == len(a) and j == len(b):
+        return 0
+    return -1 if i == len(a) else 1
+
+
+def compare_evr(evr1, evr2):
+    """Compare two (epoch, version, release) tuples, rpm style."""
+    epoch1, epoch2 = int(evr1[0] or 0), int(evr2[0] or 0)
+    if epoch1 != epoch2:
+        return 1 if epoch1 > epoch2 else -1
+    return rpmvercmp(evr1[1], evr2[1]) or rpmvercmp(evr1[2], evr2[2])
+
+
+def api_rate(value):
+    """Parse a --api-rate value (BUDGET=RATE) into (budget, rate)."""
+    budget, _, rate = value.partition("=")
+    try:
+        rate = float(rate)
+    except ValueError:
+        rate = 0
+    if budget not in API_RATES or rate <= 0:
+        raise argparse.ArgumentTypeError(
+            "expected BUDGET=RATE with BUDGET one of %s and a positive RATE, got '%s'"
+            % (", ".join(API_RATES), value)
+        )
+    return budget, rate
+
+
+def api_overloaded(e):
+    """Return True if a COPR API error means throttling or an overloaded server."""
+    if isinstance(e, (OSError, CoprTimeoutException)):
+        return True
+    response = e.result.get("__response__") if isinstance(e, CoprException) else None
+    status = getattr(response, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose rate adapts to API overload.
+
+    The rate is halved whenever the API reports overload and raised
+    additively with every successful request, up to the configured rate.
+    """
+
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1.0, rate * API_BURST_SECONDS)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def overloaded(self):
+        """Halve the rate and drop any burst allowance."""
+        with self._lock:
+            self.rate = max(self.max_rate * API_RATE_FLOOR, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+
+    def succeeded(self):
+        """Raise the rate a step towards the configured rate."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * API_RATE_STEP)
+
+
+class RateLimiter:
+    """Token buckets for COPR API requests, by budget.
+
+    Uploads and other build submissions, status reads of in-flight builds
+    and history listings each have their own budget (see API_RATES). One
+    limiter is shared by all bridges talking to the same COPR instance.
+    """
+
+    def __init__(self, rates=None):
+        rates = dict(API_RATES, **(rates or {}))
+        self.buckets = {budget: TokenBucket(rate) for budget, rate in rates.items()}
+
+    def call(self, budget, func, *args, **kwargs):
+        """Call a COPR API function within a budget, adapting it to errors."""
+        bucket = self.buckets[budget]
+        bucket.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except (CoprException, OSError) as e:
+            if api_overloaded(e):
+                bucket.overloaded()
+                logging.warning(
+                    "COPR API overloaded, slowing %s requests to %.2f/s: %s",
+                    budget,
+                    bucket.rate,
+                    e,
+                )
+            raise
+        bucket.succeeded()
+        return result
+
+
 class InotifyWatcher:
     """Minimal inotify wrapper using ctypes (Linux only)."""
 
     IN_CLOSE_WRITE = 0x00000008
     IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
     EVENT_HEADER_SIZE = struct.calcsize("iIII")
+    READ_SIZE = 65536
 
     def __init__(self):
         libc = CDLL(find_library("c"), use_errno=True)
@@ -68,9 +360,15 @@ class InotifyWatcher:
             raise OSError(get_errno(), "inotify_add_watch failed for %s" % path)
         return wd
 
-    def read_events(self):
-        """Block until events are available, then yield (wd, mask, cookie, name) tuples."""
-        buf = os.read(self._fd, 8192)
+    def read_events(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for events.
+
+        Yields (wd, mask, cookie, name) tuples; nothing if the timeout expired.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return
+        buf = os.read(self._fd, self.READ_SIZE)
         offset = 0
         while offset < len(buf):
             wd, mask, cookie, name_len = struct.unpack_from("iIII", buf, offset)
@@ -79,25 +377,490 @@ class InotifyWatcher:
             offset += name_len
             yield (wd, mask, cookie, name)
 
+    def fileno(self):
+        """Return the inotify file descriptor."""
+        return self._fd
+
     def close(self):
         """Close the inotify file descriptor."""
         os.close(self._fd)
 
 
+class UnixSocketNotifier:
+    """Receive COPR build notifications as JSON datagrams on a unix socket.
+
+    A local relay, e.g. a fedora-messaging consumer of the copr.build.end
+    topic, forwards each message (or just its body) as one datagram. Only
+    the build id is used; the build state is then polled from COPR.
+    """
+
+    READ_SIZE = 65536
+
+    def __init__(self, path):
+        self.path = path
+        # Only replace a stale socket, never another kind of file
+        if not self._remove_socket(path) and os.path.lexists(path):
+            raise FileExistsError("%s exists and is not a socket" % path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(path)
+        self._sock.setblocking(False)
+
+    def read_build_ids(self):
+        """Return the ids of the builds notified since the last call."""
+        build_ids = set()
+        while True:
+            try:
+                data = self._sock.recv(self.READ_SIZE)
+            except BlockingIOError:
+                return build_ids
+            try:
+                message = json.loads(data)
+                body = message.get("body", message)
+                build_ids.add(int(body["build"]))
+            except (ValueError, TypeError, KeyError, AttributeError):
+                logging.debug("Ignoring malformed notification: %r", data[:200])
+
+    def fileno(self):
+        """Return the socket file descriptor."""
+        return self._sock.fileno()
+
+    def close(self):
+        """Close and remove the socket."""
+        self._sock.close()
+        self._remove_socket(self.path)
+
+    @staticmethod
+    def _remove_socket(path):
+        """Remove path if it is a socket. Return True if it was removed."""
+        try:
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                return False
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+
+# Notification backends by the scheme of --notify; each takes the rest of
+# the --notify value and provides read_build_ids(), fileno() and close()
+NOTIFIERS = {
+    "unix": UnixSocketNotifier,
+}
+
+
+def create_notifier(spec):
+    """Create the notification backend for a --notify value (SCHEME:ADDRESS)."""
+    scheme, _, address = spec.partition(":")
+    if scheme not in NOTIFIERS or not address:
+        ERROR(
+            "Unsupported --notify value '%s', expected one of: %s"
+            % (spec, ", ".join("%s:ADDRESS" % s for s in NOTIFIERS))
+        )
+    try:
+        return NOTIFIERS[scheme](address)
+    except OSError as e:
+        ERROR("Cannot listen for notifications on %s: %s" % (spec, e))
+
+
+class TruncatedRpmError(ValueError):
+    """An RPM file ending early, as while it is still being written."""
+
+
+class RpmHeader:
+    """Minimal pure-Python reader for RPM file headers."""
+
+    LEAD_SIZE = 96
+    LEAD_MAGIC = b"\xed\xab\xee\xdb"
+    HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+    HEADER_INTRO = struct.Struct(">4s4xii")
+    INDEX_ENTRY = struct.Struct(">iiii")
+    # Sanity limits to reject garbage before allocating buffers
+    MAX_INDEX_ENTRIES = 0x10000
+    MAX_DATA_SIZE = 0x10000000
+
+    TAG_NAME = 1000
+    TAG_VERSION = 1001
+    TAG_RELEASE = 1002
+    TAG_EPOCH = 1003
+    TAG_PROVIDENAME = 1047
+    TAG_REQUIRENAME = 1049
+    TAG_PAYLOADDIGEST = 5092
+    TAG_PAYLOADDIGESTALGO = 5093
+
+    # Signature header tags: header+payload size and digests
+    SIGTAG_SIZE = 1000
+    SIGTAG_MD5 = 1004
+    SIGTAG_SHA1 = 269
+    SIGTAG_LONGSIZE = 270
+    SIGTAG_SHA256 = 273
+
+    # OpenPGP hash algorithm ids, as used by TAG_PAYLOADDIGESTALGO
+    DIGEST_ALGOS = {
+        1: "md5",
+        2: "sha1",
+        8: "sha256",
+        9: "sha384",
+        10: "sha512",
+        11: "sha224",
+    }
+
+    TYPE_INT16 = 3
+    TYPE_INT32 = 4
+    TYPE_INT64 = 5
+    TYPE_STRING = 6
+    TYPE_STRING_ARRAY = 8
+    TYPE_I18NSTRING = 9
+
+    def __init__(self, path):
+        """Read lead, signature and main header of the RPM at path.
+
+        Raises ValueError if the file is not a well-formed RPM, or
+        TruncatedRpmError if it ends before its headers do.
+        """
+        with open(path, "rb") as f:
+            lead = f.read(self.LEAD_SIZE)
+            if lead[:4] != self.LEAD_MAGIC[: len(lead)]:
+                raise ValueError("%s: not an RPM file" % path)
+            if len(lead) != self.LEAD_SIZE:
+                raise TruncatedRpmError("%s: truncated lead" % path)
+            self.signature, sig_size = self._read_header(f)
+            # The signature header is padded to an 8-byte boundary
+            f.read((8 - sig_size % 8) % 8)
+            self.header_offset = f.tell()
+            self.tags, header_size = self._read_header(f)
+            self.payload_offset = self.header_offset + header_size
+
+    @classmethod
+    def _read_header(cls, f):
+        """Read one header structure from f, return (tags, size in bytes)."""
+        intro = f.read(cls.HEADER_INTRO.size)
+        if len(intro) != cls.HEADER_INTRO.size:
+            raise TruncatedRpmError("truncated header")
+        magic, nindex, hsize = cls.HEADER_INTRO.unpack(intro)
+        if magic != cls.HEADER_MAGIC:
+            raise ValueError("bad header magic")
+        if not 0 <= nindex <= cls.MAX_INDEX_ENTRIES:
+            raise ValueError("bad header index count %d" % nindex)
+        if not 0 <= hsize <= cls.MAX_DATA_SIZE:
+            raise ValueError("bad header data size %d" % hsize)
+
+        index = f.read(nindex * cls.INDEX_ENTRY.size)
+        store = f.read(hsize)
+        if len(index) != nindex * cls.INDEX_ENTRY.size or len(store) != hsize:
+            raise TruncatedRpmError("truncated header")
+
+        tags = {}
+        for tag, tag_type, offset, count in cls.INDEX_ENTRY.iter_unpack(index):
+            if not 0 <= offset < hsize and count:
+                raise ValueError("bad offset for tag %d" % tag)
+            if tag_type in (
+                cls.TYPE_STRING,
+                cls.TYPE_STRING_ARRAY,
+                cls.TYPE_I18NSTRING,
+            ):
+                values = []
+                for _ in range(count):
+                    end = store.index(b"\x00", offset)
+                    values.append(store[offset:end].decode(errors="replace"))
+                    offset = end + 1
+                tags[tag] = values[0] if tag_type == cls.TYPE_STRING else values
+            elif tag_type == cls.TYPE_INT32:
+                tags[tag] = list(struct.unpack_from(">%di" % count, store, offset))
+            elif tag_type == cls.TYPE_INT16:
+                tags[tag] = list(struct.unpack_from(">%dh" % count, store, offset))
+            elif tag_type == cls.TYPE_INT64:
+                tags[tag] = list(struct.unpack_from(">%dq" % count, store, offset))
+            else:
+                tags[tag] = store[offset : offset + count]
+        size = cls.HEADER_INTRO.size + len(index) + hsize
+        return tags, size
+
+    def get(self, tag, default=None):
+        """Return the value of a main header tag."""
+        return self.tags.get(tag, default)
+
+
+def validate_srpm(path):
+    """Check an SRPM before submission, return (verdict, detail, sha256).
+
+    Parses lead, signature and main header, compares the header+payload
+    size recorded in the signature with the file size and verifies the
+    header and payload digests, where the SRPM has them. The verdict is
+    "valid", "incomplete" if the file ends early (likely still being
+    written) or "invalid"; sha256 is the digest of a valid file, computed
+    in the same pass over it.
+    """
+    try:
+        rpm = RpmHeader(path)
+        size = os.path.getsize(path)
+    except TruncatedRpmError as e:
+        return "incomplete", str(e), None
+    except (OSError, ValueError, struct.error) as e:
+        return "invalid", str(e), None
+
+    signature = rpm.signature
+    declared = signature.get(RpmHeader.SIGTAG_LONGSIZE) or signature.get(
+        RpmHeader.SIGTAG_SIZE
+    )
+    if declared:
+        expected = rpm.header_offset + declared[0]
+        if size < expected:
+            return "incomplete", "%d of %d bytes" % (size, expected), None
+        if size > expected:
+            return "invalid", "%d bytes, headers declare %d" % (size, expected), None
+
+    # (description, digest, start, end, expected hex digest) per region
+    file_digest = hashlib.sha256()
+    checks = []
+    if RpmHeader.SIGTAG_SHA256 in signature:
+        checks.append(
+            (
+                "header SHA-256",
+                hashlib.sha256(),
+                rpm.header_offset,
+                rpm.payload_offset,
+                signature[RpmHeader.SIGTAG_SHA256],
+            )
+        )
+    elif RpmHeader.SIGTAG_SHA1 in signature:
+        checks.append(
+            (
+                "header SHA-1",
+                hashlib.sha1(usedforsecurity=False),
+                rpm.header_offset,
+                rpm.payload_offset,
+                signature[RpmHeader.SIGTAG_SHA1],
+            )
+        )
+    payload_digests = rpm.get(RpmHeader.TAG_PAYLOADDIGEST)
+    algo = RpmHeader.DIGEST_ALGOS.get(rpm.get(RpmHeader.TAG_PAYLOADDIGESTALGO, [8])[0])
+    if payload_digests and algo:
+        checks.append(
+            (
+                "payload digest",
+                hashlib.new(algo, usedforsecurity=False),
+                rpm.payload_offset,
+                size,
+                payload_digests[0],
+            )
+        )
+    elif RpmHeader.SIGTAG_MD5 in signature:
+        checks.append(
+            (
+                "header+payload MD5",
+                hashlib.md5(usedforsecurity=False),
+                rpm.header_offset,
+                size,
+                bytes(signature[RpmHeader.SIGTAG_MD5]).hex(),
+            )
+        )
+
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, HASH_CHUNK_SIZE):
+                        end = min(offset + HASH_CHUNK_SIZE, size)
+                        file_digest.update(view[offset:end])
+                        for _, digest, start, stop, _ in checks:
+                            if start < end and offset < stop:
+                                digest.update(view[max(offset, start) : min(end, stop)])
+    except (OSError, ValueError) as e:
+        return "invalid", str(e), None
+
+    for description, digest, _, _, expected in checks:
+        if digest.hexdigest() != expected.lower():
+            return "invalid", "%s mismatch" % description, None
+    return "valid", None, file_digest.hexdigest()
+
+
+class Metrics:
+    """Prometheus metrics of the bridge in the text exposition format.
+
+    Counters and summaries are updated by the bridge; gauges are sampled
+    from callbacks whenever the metrics are rendered. All samples carry
+    labels, e.g. the pipeline in daemon mode, where one Metrics renders
+    those of every bridge it includes.
+    """
+
+    DEFINITIONS = {
+        "copr_bridge_queue_depth": (
+            "gauge",
+            "SRPMs waiting for submission",
+        ),
+        "copr_bridge_inflight_builds": (
+            "gauge",
+            "COPR builds submitted and not finished yet",
+        ),
+        "copr_bridge_builds_total": (
+            "counter",
+            "Finished COPR builds by terminal state",
+        ),
+        "copr_bridge_skipped_total": (
+            "counter",
+            "SRPMs not submitted, by reason",
+        ),
+        "copr_bridge_submit_duration_seconds": (
+            "summary",
+            "Time taken to create a COPR build, by method",
+        ),
+        "copr_bridge_upload_bytes_total": (
+            "counter",
+            "SRPM bytes uploaded to COPR",
+        ),
+        "copr_bridge_submit_delay_seconds": (
+            "summary",
+            "Time from SRPM modification to COPR submission",
+        ),
+        "copr_bridge_poll_duration_seconds": (
+            "summary",
+            "Time taken to poll the in-flight builds",
+        ),
+        "copr_bridge_api_errors_total": (
+            "counter",
+            "Failed COPR API requests, by operation",
+        ),
+        "copr_bridge_poll_retries_total": (
+            "counter",
+            "Retried poll cycles",
+        ),
+        "copr_bridge_build_retries_total": (
+            "counter",
+            "Failed builds scheduled for another attempt",
+        ),
+        "copr_bridge_preflight_rejects_total": (
+            "counter",
+            "SRPMs held back by pre-flight validation, by verdict",
+        ),
+    }
+
+    def __init__(self, labels=()):
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._gauges = {}
+        self._included = []
+
+    def include(self, metrics):
+        """Render the samples of another Metrics along with these."""
+        self._included.append(metrics)
+
+    def gauge(self, name, func):
+        """Sample gauge name from func() when rendering."""
+        self._gauges[name] = func
+
+    def inc(self, name, value=1, **labels):
+        """Increase counter name by value."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one observation of summary name."""
+        self.inc(name + "_sum", value, **labels)
+        self.inc(name + "_count", 1, **labels)
+
+    def samples(self):
+        """Return {(sample name, labels): value}, of included metrics too."""
+        with self._lock:
+            values = dict(self._values)
+        for name, func in self._gauges.items():
+            values[(name, ())] = func()
+        values = {
+            (name, self.labels + labels): value
+            for (name, labels), value in values.items()
+        }
+        for metrics in self._included:
+            values.update(metrics.samples())
+        return values
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        values = self.samples()
+
+        lines = []
+        for name, (kind, description) in self.DEFINITIONS.items():
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for (sample, labels), value in sorted(values.items()):
+                if sample not in (name, name + "_sum", name + "_count"):
+                    continue
+                if labels:
+                    sample += "{%s}" % ",".join(
+                        '%s="%s"' % (label, self._escape(label_value))
+                        for label, label_value in labels
+                    )
+                lines.append("%s %s" % (sample, repr(float(value))))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _escape(value):
+        """Escape a label value for the text exposition format."""
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def write(self, path):
+        """Write the metrics atomically, e.g. for node_exporter's textfile collector."""
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(self.render())
+            os.rename(tmp_path, path)
+        except OSError as e:
+            logging.error("Failed to write metrics to %s: %s", path, e)
+
+    def serve(self, port):
+        """Serve the metrics on http://127.0.0.1:port/metrics from a thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("metrics: " + format, *args)
+
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        except OSError as e:
+            ERROR("Cannot serve metrics on port %d: %s" % (port, e))
+        threading.Thread(
+            target=server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logging.info("Serving metrics on http://127.0.0.1:%d/metrics", port)
+
+
 class CoprBridge:
     """Bridge OBS SRPMs to Fedora COPR builds."""
 
     STATE_VERSION = 1
 
-    def __init__(self, args):
+    def __init__(self, args, client=None, limiter=None):
         self.srpm_dir = args.srpm_dir
         self.copr_project = args.copr_project
-        self.chroot = args.chroot
+        self.chroots = getattr(args, "chroots", None) or []
+        self.srpm_base_url = getattr(args, "srpm_base_url", None)
+        self.metrics_file = getattr(args, "metrics_file", None)
+        # Source of build notifications, set up by main() with --notify
+        self.notifier = None
+        # Worker processes of preflight_srpms, started on first use
+        self._preflight_pool = None
         self.state_file = args.state_file
         self.dryrun = args.dryrun
         self.ignore_errors = args.ignore_errors
         self.force_rebuild = args.force_rebuild
         self.poll_interval = args.poll_interval
+        self.max_inflight = args.max_inflight
+        self.schedule = getattr(args, "schedule", "mtime")
+        self.max_attempts = getattr(args, "max_attempts", 1)
+        self.retry_backoff = getattr(args, "retry_backoff", 300)
         self.debug = args.debug
 
         self.skip_patterns = [re.compile(p) for p in args.skip_pattern]
@@ -105,18 +868,81 @@ class CoprBridge:
 
         self.ownername, self.projectname = self._parse_copr_project()
 
-        if not self.dryrun:
-            config_path = getattr(args, "copr_config", None)
-            if config_path:
-                self.client = Client.create_from_config_file(Path(config_path))
-            else:
-                self.client = Client.create_from_config_file()
+        if limiter is not None:
+            self.limiter = limiter
         else:
+            self.limiter = RateLimiter(dict(getattr(args, "api_rate", None) or []))
+        if self.dryrun:
             self.client = None
-
+        elif client is not None:
+            self.client = client
+        else:
+            self.client = create_client(args)
+
+        self.journal_file = self.state_file + ".journal"
+        self.history_file = self.state_file + ".copr-history"
+        self.history_refresh = args.history_refresh
+        self.dir_index_file = self.state_file + ".dir-index"
+        self.archive_dir = self.state_file + ".archive"
+        self.retention_days = getattr(args, "retention_days", None)
+        self.retention_releases = getattr(args, "retention_releases", None)
+        self.dir_index = self._load_dir_index()
+        self._dir_index_dirty = False
+        self._journal_fh = None
+        self._journal_records = 0
         self.state = self.load_state()
         self._shutdown = False
 
+        # SRPMs waiting for submission and builds currently in COPR
+        self.queue = deque()
+        self.queued_names = set()
+        self.inflight = {}
+        # In-flight builds re-attached from a previous run's pending entries
+        self._reattached = set()
+        # (name, provides, requires, evr) per SRPM and the pending SRPMs each
+        # queued SRPM has to wait for
+        self._srpm_info = {}
+        self.depends = {}
+        # Critical path per queued SRPM and the queue in descending order of
+        # them for --schedule longest-first, computed again once the
+        # dependencies or build durations change
+        self._paths = None
+        self._longest_first = None
+        # SHA-256 per queued SRPM and the SRPM that successfully built each
+        # content hash in each chroot
+        self._srpm_sha256 = {}
+        self._built_content = {}
+        for srpm_name, entry in self.state["builds"].items():
+            if entry.get("sha256") and "duplicate_of" not in entry:
+                for chroot in self._succeeded_chroots(entry):
+                    self._built_content[(entry["sha256"], chroot)] = srpm_name
+        # Chroots each queued SRPM still needs a build for
+        self._target_chroots = {}
+        # Recent build durations per package, and the delay until each
+        # in-flight build should be checked again
+        self._durations = {
+            package: list(durations)
+            for package, durations in self.state.get("durations", {}).items()
+        }
+        for srpm_name, entry in self.state["builds"].items():
+            if entry.get("build_seconds") is not None:
+                self._record_duration(srpm_name, entry["build_seconds"])
+        self._check_delays = {}
+        self._last_states = {}
+        self._halted = False
+        self._next_poll = 0
+        self._poll_retries = 0
+
+        # Outcomes for the scan summary (cleared as they go in daemon mode);
+        # failed SRPMs also hold back the SRPMs depending on them
+        self.succeeded_names = []
+        self.skipped_names = []
+        self.failed_names = set()
+
+        self.metrics = Metrics()
+        self.metrics.gauge("copr_bridge_queue_depth", lambda: len(self.queue))
+        self.metrics.gauge("copr_bridge_inflight_builds", lambda: len(self.inflight))
+
     def _parse_copr_project(self):
         """Split copr_project into (ownername, projectname)."""
         if "/" not in self.copr_project:
@@ -128,59 +954,340 @@ class CoprBridge:
         return parts[0], parts[1]
 
     def load_state(self):
-        """Load state from JSON file. Return empty state if missing or corrupt."""
+        """Load state from JSON file and replay the journal on top of it.
+
+        Return empty state (plus journal) if the state file is missing or corrupt.
+        """
         if not os.path.exists(self.state_file):
             logging.debug("No state file found at %s, starting fresh", self.state_file)
-            return self._empty_state()
+            state = self._empty_state()
+        else:
+            try:
+                with open(self.state_file) as f:
+                    state = json.load(f)
+                logging.info(
+                    "Loaded state from %s (%d builds tracked)",
+                    self.state_file,
+                    len(state.get("builds", {})),
+                )
+            except (json.JSONDecodeError, OSError) as e:
+                logging.warning(
+                    "Failed to read state file %s: %s. Starting with empty state.",
+                    self.state_file,
+                    e,
+                )
+                state = self._empty_state()
+
+        self._replay_journal(state)
+        return state
+
+    def _replay_journal(self, state):
+        """Apply journal records written since the last compaction to state."""
+        if not os.path.exists(self.journal_file):
+            return
 
         try:
-            with open(self.state_file) as f:
-                state = json.load(f)
-            logging.info(
-                "Loaded state from %s (%d builds tracked)",
-                self.state_file,
-                len(state.get("builds", {})),
-            )
-            return state
-        except (json.JSONDecodeError, OSError) as e:
-            logging.warning(
-                "Failed to read state file %s: %s. Starting with empty state.",
-                self.state_file,
-                e,
-            )
-            return self._empty_state()
+            complete = 0
+            with open(self.journal_file, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # A crash can leave a partially written last record;
+                        # cut it off, or the next record would be appended
+                        # to its line and get lost as well
+                        logging.warning("Dropping torn state journal record")
+                        os.truncate(self.journal_file, complete)
+                        break
+                    complete += len(line)
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning("Ignoring corrupt state journal record")
+                        continue
+                    if "build" not in record:
+                        state[record["key"]] = record["value"]
+                    elif record["entry"] is None:
+                        state["builds"].pop(record["build"], None)
+                    else:
+                        state["builds"][record["build"]] = record["entry"]
+                    self._journal_records += 1
+        except OSError as e:
+            logging.warning("Failed to read state journal %s: %s", self.journal_file, e)
+            return
+
+        logging.info(
+            "Replayed %d state change(s) from %s",
+            self._journal_records,
+            self.journal_file,
+        )
 
     def _empty_state(self):
         return {
             "version": self.STATE_VERSION,
             "srpm_dir": self.srpm_dir,
             "copr_project": self.copr_project,
-            "chroot": self.chroot,
+            "chroot": self.chroots[0] if self.chroots else None,
+            "chroots": self.chroots,
             "builds": {},
             "last_succeeded": None,
             "blocked_on": None,
         }
 
     def save_state(self):
-        """Write state to JSON file atomically (write temp, then rename)."""
+        """Compact state: write the full JSON file atomically, drop the journal.
+
+        Also writes the directory index if it changed since the last scan.
+        """
+        if self._dir_index_dirty:
+            self._save_dir_index()
+        if self.retention_days is not None or self.retention_releases is not None:
+            self._archive_builds()
         tmp_path = self.state_file + ".tmp"
         try:
             with open(tmp_path, "w") as f:
                 json.dump(self.state, f, indent=2)
                 f.write("\n")
+                f.flush()
+                os.fsync(f.fileno())
             os.rename(tmp_path, self.state_file)
+            if self._journal_fh is not None:
+                self._journal_fh.close()
+                self._journal_fh = None
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self._journal_records = 0
         except OSError as e:
             logging.error("Failed to save state file: %s", e)
 
+    @staticmethod
+    def _entry_time(entry):
+        """Return when a state entry was last recorded, as a Unix timestamp."""
+        for field in ("completed_at", "submitted_at"):
+            if entry.get(field):
+                recorded = datetime.strptime(entry[field], "%Y-%m-%dT%H:%M:%S")
+                return recorded.replace(tzinfo=timezone.utc).timestamp()
+        return entry.get("mtime") or 0
+
+    def _expired_builds(self):
+        """Return the archivable state entries beyond the retention policy."""
+        builds = self.state["builds"]
+        expired = set()
+        if self.retention_days is not None:
+            cutoff = time.time() - self.retention_days * 86400
+            expired.update(n for n, e in builds.items() if self._entry_time(e) < cutoff)
+        if self.retention_releases is not None:
+            releases = {}
+            for srpm_name in builds:
+                nvr = self._parse_srpm_nvr(srpm_name)
+                if nvr is not None:
+                    releases.setdefault(nvr[0], []).append(srpm_name)
+            newest_first = cmp_to_key(
+                lambda a, b: compare_evr(
+                    (0,) + self._parse_srpm_nvr(b)[1:],
+                    (0,) + self._parse_srpm_nvr(a)[1:],
+                )
+            )
+            for srpm_names in releases.values():
+                srpm_names.sort(key=newest_first)
+                expired.update(srpm_names[self.retention_releases :])
+        return [
+            srpm_name
+            for srpm_name in expired
+            if builds[srpm_name]["status"] in ARCHIVE_STATUSES
+            and srpm_name != self.state.get("blocked_on")
+        ]
+
+    def _archive_builds(self):
+        """Move state entries beyond the retention policy to an archive segment.
+
+        Segments are gzipped journals in the archive directory. Archived
+        SRPMs that count as processed keep a name -> status (or skip reason)
+        entry in the "archived" index while they are still in srpm_dir, and
+        build durations move to the per-package "durations" history.
+        """
+        present = self.dir_index
+        archived = {
+            srpm_name: outcome
+            for srpm_name, outcome in self.state.get("archived", {}).items()
+            if not present or srpm_name in present
+        }
+        self.state["archived"] = archived
+
+        builds = self.state["builds"]
+        expired = sorted(
+            self._expired_builds(), key=lambda n: self._entry_time(builds[n])
+        )
+        if not expired:
+            return
+
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%f")
+        segment = os.path.join(self.archive_dir, stamp + ".jsonl.gz")
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with open(segment + ".tmp", "wb") as f:
+                with gzip.GzipFile(fileobj=f, mode="wb") as archive:
+                    for srpm_name in expired:
+                        record = {"build": srpm_name, "entry": builds[srpm_name]}
+                        line = json.dumps(record, separators=(",", ":")) + "\n"
+                        archive.write(line.encode())
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(segment + ".tmp", segment)
+        except OSError as e:
+            logging.error("Failed to write state archive %s: %s", segment, e)
+            return
+
+        durations = self.state.setdefault("durations", {})
+        for srpm_name in expired:
+            entry = builds.pop(srpm_name)
+            for chroot in self._succeeded_chroots(entry):
+                key = (entry.get("sha256"), chroot)
+                if self._built_content.get(key) == srpm_name:
+                    del self._built_content[key]
+            if entry.get("reason") != "dry-run" and (
+                not present or srpm_name in present
+            ):
+                archived[srpm_name] = entry.get("reason", entry["status"])
+            nvr = self._parse_srpm_nvr(srpm_name)
+            if nvr is not None and entry.get("build_seconds") is not None:
+                recent = durations.setdefault(nvr[0], [])
+                recent.append(entry["build_seconds"])
+                del recent[:-DURATION_HISTORY]
+        logging.info("Archived %d state entries to %s", len(expired), segment)
+
+    def _journal(self, record):
+        """Append a state change to the journal, compacting once it gets long."""
+        try:
+            if self._journal_fh is None:
+                self._journal_fh = open(self.journal_file, "a")
+            self._journal_fh.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._journal_fh.flush()
+        except OSError as e:
+            logging.error("Failed to write state journal: %s", e)
+            return
+
+        # Compacting after as many records as there are builds keeps the
+        # total I/O linear in the number of state changes.
+        self._journal_records += 1
+        if self._journal_records > max(COMPACT_MIN_RECORDS, len(self.state["builds"])):
+            self.save_state()
+
+    def export_metrics(self):
+        """Write the metrics to --metrics-file, if given."""
+        if self.metrics_file:
+            self.metrics.write(self.metrics_file)
+
+    def set_build(self, srpm_name, entry):
+        """Replace the state entry of an SRPM."""
+        if entry["status"] == "skipped":
+            self.metrics.inc("copr_bridge_skipped_total", reason=entry["reason"])
+        self.state["builds"][srpm_name] = entry
+        self._journal({"build": srpm_name, "entry": entry})
+
+    def update_build(self, srpm_name, **fields):
+        """Update fields of the state entry of an SRPM."""
+        entry = self.state["builds"][srpm_name]
+        entry.update(fields)
+        self._journal({"build": srpm_name, "entry": entry})
+
+    def delete_build(self, srpm_name):
+        """Remove an SRPM from state."""
+        del self.state["builds"][srpm_name]
+        self._journal({"build": srpm_name, "entry": None})
+
+    def set_state(self, key, value):
+        """Set a top-level state field."""
+        self.state[key] = value
+        self._journal({"key": key, "value": value})
+
+    def _load_dir_index(self):
+        """Load the SRPM directory index, return {name: [inode, size, mtime]}."""
+        try:
+            with open(self.dir_index_file) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, OSError) as e:
+            logging.warning(
+                "Failed to read directory index %s: %s", self.dir_index_file, e
+            )
+            return {}
+
+        if index.get("srpm_dir") != os.path.abspath(self.srpm_dir):
+            logging.info(
+                "Directory index %s is for another directory", self.dir_index_file
+            )
+            return {}
+        return index["entries"]
+
+    def _save_dir_index(self):
+        """Write the SRPM directory index atomically."""
+        tmp_path = self.dir_index_file + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        "srpm_dir": os.path.abspath(self.srpm_dir),
+                        "entries": self.dir_index,
+                    },
+                    f,
+                )
+            os.rename(tmp_path, self.dir_index_file)
+            self._dir_index_dirty = False
+        except OSError as e:
+            logging.error("Failed to save directory index: %s", e)
+
+    def index_srpm(self, srpm_path):
+        """Stat a single SRPM into the directory index. Return False if gone."""
+        try:
+            st = srpm_path.stat()
+        except FileNotFoundError:
+            return False
+        self.dir_index[srpm_path.name] = [st.st_ino, st.st_size, st.st_mtime]
+        self._dir_index_dirty = True
+        return True
+
+    def _srpm_mtime(self, srpm_path):
+        """Return the indexed mtime of an SRPM, falling back to stat()."""
+        entry = self.dir_index.get(srpm_path.name)
+        if entry is None:
+            return srpm_path.stat().st_mtime
+        return entry[2]
+
     def scan_srpms(self):
-        """Scan srpm_dir for *.src.rpm files, return sorted by mtime ascending."""
-        srpm_dir = Path(self.srpm_dir)
-        if not srpm_dir.is_dir():
+        """Scan srpm_dir for *.src.rpm files, return sorted by mtime ascending.
+
+        Each entry is stat()ed once; the persisted directory index is only
+        rewritten if entries are new, gone, replaced or rewritten in place
+        (their inode, size or mtime changed) since the previous scan.
+        """
+        if not os.path.isdir(self.srpm_dir):
             ERROR("SRPM directory does not exist: %s" % self.srpm_dir)
 
-        srpms = list(srpm_dir.glob("*.src.rpm"))
-        srpms.sort(key=lambda p: p.stat().st_mtime)
+        index = {}
+        changed = 0
+        with os.scandir(self.srpm_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".src.rpm"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                index[entry.name] = [st.st_ino, st.st_size, st.st_mtime]
+                if self.dir_index.get(entry.name) != index[entry.name]:
+                    changed += 1
+
+        if changed or index.keys() != self.dir_index.keys():
+            self.dir_index = index
+            self._save_dir_index()
+
+        srpm_dir = Path(self.srpm_dir)
+        srpms = [
+            srpm_dir / name
+            for name in sorted(index, key=lambda name: (index[name][2], name))
+        ]
         logging.info("Found %d SRPMs in %s", len(srpms), self.srpm_dir)
+        logging.debug("%d SRPMs are new or changed since the last scan", changed)
         return srpms
 
     def should_process(self, srpm_name):
@@ -206,7 +1313,11 @@ class CoprBridge:
     def already_processed(self, srpm_name):
         """Check if an SRPM was already processed in a prior run."""
         if srpm_name not in self.state["builds"]:
-            return False
+            # Archived SRPMs only keep their status, or reason if skipped
+            outcome = self.state.get("archived", {}).get(srpm_name)
+            if outcome is None:
+                return False
+            return not (self.force_rebuild and outcome == "already-in-copr")
 
         entry = self.state["builds"][srpm_name]
         # Dry-run entries do not count as processed
@@ -215,21 +1326,87 @@ class CoprBridge:
         # --force-rebuild overrides the COPR existence check
         if self.force_rebuild and entry.get("reason") == "already-in-copr":
             return False
-        return entry["status"] in ("succeeded", "skipped")
+        # Built SRPMs are only done if built for every --chroot, so that
+        # chroots added later get their builds
+        if self.chroots and (
+            entry["status"] == "succeeded" or entry.get("reason") in BUILT_REASONS
+        ):
+            done = self._done_chroots(entry)
+            return all(c in done for c in self.chroots)
+        return entry["status"] in ("succeeded", "skipped", "permanently-failed")
+
+    def _published_url(self, srpm_path):
+        """Return the URL of an SRPM under --srpm-base-url, or None.
+
+        None is also returned if the URL cannot be fetched or serves a file
+        of a different size than the local one.
+        """
+        if not self.srpm_base_url:
+            return None
+        url = "%s/%s" % (
+            self.srpm_base_url.rstrip("/"),
+            urllib.parse.quote(srpm_path.name),
+        )
+        try:
+            request = urllib.request.Request(url, method="HEAD")
+            with urllib.request.urlopen(request, timeout=URL_CHECK_TIMEOUT) as response:
+                length = response.headers.get("Content-Length")
+        except (OSError, ValueError, HTTPException) as e:
+            logging.warning("%s is not reachable (%s), uploading instead", url, e)
+            return None
+
+        entry = self.dir_index.get(srpm_path.name)
+        if length is not None and entry is not None and int(length) != entry[1]:
+            logging.warning(
+                "%s has %s bytes instead of %d, uploading instead",
+                url,
+                length,
+                entry[1],
+            )
+            return None
+        return url
 
-    def submit_build(self, srpm_path):
-        """Upload SRPM to COPR and return the build object."""
+    def submit_build(self, srpm_path, chroots):
+        """Submit SRPM to COPR by URL or upload, return the build object.
+
+        One build is created for all given chroots; [None] stands for the
+        project's default chroots.
+        """
         logging.info("Submitting %s to COPR %s", srpm_path.name, self.copr_project)
 
         try:
             buildopts = {}
-            if self.chroot:
-                buildopts["chroots"] = [self.chroot]
-            build = self.client.build_proxy.create_from_file(
-                ownername=self.ownername,
-                projectname=self.projectname,
-                path=str(srpm_path),
-                buildopts=buildopts if buildopts else None,
+            if chroots != [None]:
+                buildopts["chroots"] = chroots
+            url = self._published_url(srpm_path)
+            started = time.monotonic()
+            if url is not None:
+                logging.debug("Building %s from %s", srpm_path.name, url)
+                build = self.limiter.call(
+                    "submit",
+                    self.client.build_proxy.create_from_url,
+                    ownername=self.ownername,
+                    projectname=self.projectname,
+                    url=url,
+                    buildopts=buildopts if buildopts else None,
+                )
+            else:
+                build = self.limiter.call(
+                    "submit",
+                    self.client.build_proxy.create_from_file,
+                    ownername=self.ownername,
+                    projectname=self.projectname,
+                    path=str(srpm_path),
+                    buildopts=buildopts if buildopts else None,
+                )
+                self.metrics.inc(
+                    "copr_bridge_upload_bytes_total",
+                    self.dir_index.get(srpm_path.name, [0, 0])[1],
+                )
+            self.metrics.observe(
+                "copr_bridge_submit_duration_seconds",
+                time.monotonic() - started,
+                method="url" if url is not None else "upload",
             )
             logging.info(
                 "Build submitted: id=%d, url=https://copr.fedorainfracloud.org"
@@ -242,40 +1419,101 @@ class CoprBridge:
             ERROR(
                 "COPR authentication failed: %s\nCheck your ~/.config/copr token." % e
             )
-        except CoprException as e:
+        except (CoprException, OSError) as e:
+            # Includes connection errors during upload; like API errors
+            # they fail the submission, which may be retried
+            self.metrics.inc("copr_bridge_api_errors_total", operation="submit")
             logging.error("COPR API error submitting %s: %s", srpm_path.name, e)
             return None
 
-    def poll_build(self, build_id):
-        """Poll COPR for build status until a terminal state is reached."""
-        last_state = None
-        retries = 0
+    def _list_inflight_builds(self):
+        """Fetch all in-flight builds, return dict of build_id -> build.
 
-        while not self._shutdown:
+        Pages through the project build list newest first, so a single call
+        usually covers every in-flight build. Only builds that dropped out
+        of the listing (e.g. deleted) are fetched individually.
+        """
+        wanted = set(self.inflight.values())
+        oldest = min(wanted)
+        found = {}
+        offset = 0
+
+        while wanted - found.keys():
+            builds = self.limiter.call(
+                "status",
+                self.client.build_proxy.get_list,
+                ownername=self.ownername,
+                projectname=self.projectname,
+                pagination={
+                    "limit": POLL_PAGE_SIZE,
+                    "offset": offset,
+                    "order": "id",
+                    "order_type": "DESC",
+                },
+            )
+            for build in builds:
+                if build.id in wanted:
+                    found[build.id] = build
+            if len(builds) < POLL_PAGE_SIZE or builds[-1].id <= oldest:
+                break
+            offset += POLL_PAGE_SIZE
+
+        for build_id in wanted - found.keys():
+            logging.debug("Build %d not in project build list, fetching", build_id)
             try:
-                build = self.client.build_proxy.get(build_id)
-                retries = 0
-            except (CoprException, OSError) as e:
-                retries += 1
-                if retries > MAX_RETRIES:
-                    logging.error(
-                        "Failed to poll build %d after %d retries: %s",
-                        build_id,
-                        MAX_RETRIES,
-                        e,
-                    )
-                    return None
-                wait_time = RETRY_BASE_SECONDS * (2 ** (retries - 1))
-                logging.warning(
-                    "Poll failed (attempt %d/%d), retrying in %ds: %s",
-                    retries,
+                found[build_id] = self.limiter.call(
+                    "status", self.client.build_proxy.get, build_id
+                )
+            except CoprNoResultException:
+                logging.error("Build %d no longer exists in COPR", build_id)
+                found[build_id] = None
+
+        return found
+
+    def poll_inflight(self):
+        """Refresh all in-flight builds once, return list of (srpm_name, build).
+
+        Only builds that reached a terminal (or unknown) state are returned.
+        A build of None means polling failed permanently for that SRPM, or
+        that its build no longer exists.
+        """
+        finished = []
+
+        started = time.monotonic()
+        try:
+            builds = self._list_inflight_builds()
+        except (CoprException, OSError) as e:
+            self.metrics.inc("copr_bridge_api_errors_total", operation="poll")
+            self._poll_retries += 1
+            if self._poll_retries > MAX_RETRIES:
+                logging.error(
+                    "Failed to poll %d build(s) after %d retries: %s",
+                    len(self.inflight),
                     MAX_RETRIES,
-                    wait_time,
                     e,
                 )
-                time.sleep(wait_time)
-                continue
+                self._poll_retries = 0
+                return [(name, None) for name in self.inflight]
+            self.metrics.inc("copr_bridge_poll_retries_total")
+            logging.warning(
+                "Poll failed (attempt %d/%d), retrying in %ds: %s",
+                self._poll_retries,
+                MAX_RETRIES,
+                self._poll_delay(),
+                e,
+            )
+            return finished
+        self._poll_retries = 0
+        self.metrics.observe(
+            "copr_bridge_poll_duration_seconds", time.monotonic() - started
+        )
 
+        for srpm_name, build_id in self.inflight.items():
+            build = builds[build_id]
+            if build is None:
+                finished.append((srpm_name, None))
+                continue
+            last_state = self._last_states.get(build_id)
             if build.state != last_state:
                 logging.info(
                     "Build %d: %s -> %s",
@@ -283,84 +1521,850 @@ class CoprBridge:
                     last_state or "(new)",
                     build.state,
                 )
-                last_state = build.state
+                self._last_states[build_id] = build.state
 
             if build.state in TERMINAL_STATES:
-                return build
-
-            if build.state == "unknown":
+                finished.append((srpm_name, build))
+            elif build.state == "unknown":
                 logging.error("Build %d entered unknown state", build_id)
-                return build
+                finished.append((srpm_name, build))
+            else:
+                self._check_delays[build_id] = self._check_delay(srpm_name, build)
+
+        return finished
+
+    def _record_duration(self, srpm_name, seconds):
+        """Remember how long a successful build of an SRPM's package took."""
+        nvr = self._parse_srpm_nvr(srpm_name)
+        if nvr is None:
+            return
+        durations = self._durations.setdefault(nvr[0], [])
+        durations.append(seconds)
+        del durations[:-DURATION_HISTORY]
+        self._longest_first = None
+
+    def _expected_duration(self, srpm_name):
+        """Return the median recent build duration of an SRPM's package, or None."""
+        nvr = self._parse_srpm_nvr(srpm_name)
+        durations = sorted(self._durations.get(nvr[0], ())) if nvr else []
+        if not durations:
+            return None
+        return durations[len(durations) // 2]
 
-            time.sleep(self.poll_interval)
+    def _check_delay(self, srpm_name, build):
+        """Return seconds until an unfinished build is worth checking again.
+
+        Builds that have not started are checked often, since they may
+        start (and short ones finish) any moment. Running builds with a
+        known expected duration are checked sparsely at first, halving the
+        remaining time until the expected end; everything else falls back
+        to --poll-interval.
+        """
+        fast = min(self.poll_interval, POLL_FAST_SECONDS)
+        if build.state != "running":
+            return fast
+
+        expected = self._expected_duration(srpm_name)
+        started_on = getattr(build, "started_on", None)
+        if expected is None or not started_on:
+            return self.poll_interval
+
+        remaining = started_on + expected - time.time()
+        if remaining <= 0:
+            return self.poll_interval
+        if remaining <= self.poll_interval:
+            return max(remaining, min(self.poll_interval, POLL_MIN_SECONDS))
+        return max(self.poll_interval, min(remaining / 2, POLL_MAX_SECONDS))
+
+    def _poll_delay(self):
+        """Return seconds to wait before the next poll cycle.
+
+        With --notify, builds are polled when notified, so the regular
+        polls are only a slow safety net.
+        """
+        if self._poll_retries:
+            return RETRY_BASE_SECONDS * (2 ** (self._poll_retries - 1))
+        fast = min(self.poll_interval, POLL_FAST_SECONDS)
+        delay = min(
+            (self._check_delays.get(b, fast) for b in self.inflight.values()),
+            default=self.poll_interval,
+        )
+        if self.notifier is not None:
+            return max(delay, NOTIFY_POLL_SECONDS)
+        return delay
+
+    def notify_builds(self, build_ids):
+        """Poll right away if any of the notified builds is in flight."""
+        notified = set(self.inflight.values()) & set(build_ids)
+        if notified:
+            logging.debug(
+                "Notified of build(s) %s, polling",
+                ", ".join(str(b) for b in sorted(notified)),
+            )
+            self._next_poll = 0
 
-        return None
+    def _wait_for_poll(self):
+        """Sleep until the next poll is due or an in-flight build is notified."""
+        while not self._shutdown:
+            timeout = self._next_poll - time.monotonic()
+            if timeout <= 0:
+                return
+            timeout = min(timeout, SHUTDOWN_CHECK_SECONDS)
+            if self.notifier is None:
+                time.sleep(timeout)
+                continue
+            ready, _, _ = select.select([self.notifier], [], [], timeout)
+            if ready:
+                self.notify_builds(self.notifier.read_build_ids())
 
-    def process_srpm(self, srpm_path):
-        """Submit an SRPM to COPR, poll until done, update state. Return True on success."""
+    def start_srpm(self, srpm_path):
+        """Submit an SRPM to COPR and track it as in flight. Return False on error."""
         srpm_name = srpm_path.name
-        mtime = srpm_path.stat().st_mtime
+        mtime = self._srpm_mtime(srpm_path)
+        sha256 = self._srpm_sha256.pop(srpm_name, None)
+        chroots = self._target_chroots.pop(srpm_name, self.chroots or [None])
+
+        # Chroots that succeeded in an earlier submission stay recorded
+        previous = self.state["builds"].get(srpm_name, {})
+        chroot_states = {c: "succeeded" for c in self._done_chroots(previous)}
+
+        duplicates = [self._built_content.get((sha256, c)) for c in chroots]
+        duplicate_of = duplicates[0] if None not in duplicates else None
+        if duplicate_of is not None:
+            logging.info(
+                "Skipping %s (identical content already built as %s)",
+                srpm_name,
+                duplicate_of,
+            )
+            built = dict.fromkeys([*chroot_states, *chroots], "succeeded")
+            self.set_build(
+                srpm_name,
+                {
+                    "status": "skipped",
+                    "reason": "duplicate-content",
+                    "duplicate_of": duplicate_of,
+                    "sha256": sha256,
+                    "mtime": mtime,
+                    **({"chroots": built} if self.chroots else {}),
+                },
+            )
+            self.skipped_names.append(srpm_name)
+            return True
 
         if self.dryrun:
+            url = self._published_url(srpm_path)
             logging.info(
-                "[dry-run] Would submit %s to %s", srpm_name, self.copr_project
+                "[dry-run] Would submit %s to %s%s",
+                srpm_name,
+                self.copr_project,
+                " from %s" % url if url else "",
             )
-            self.state["builds"][srpm_name] = {
-                "status": "skipped",
-                "reason": "dry-run",
-                "mtime": mtime,
-            }
-            self.save_state()
+            self.set_build(
+                srpm_name,
+                {"status": "skipped", "reason": "dry-run", "mtime": mtime},
+            )
+            self.succeeded_names.append(srpm_name)
             return True
 
-        build = self.submit_build(srpm_path)
+        chroot_states.update((c, "pending") for c in chroots if c is not None)
+        attempts = 1
+        if previous.get("status") in ("failed", "unknown"):
+            attempts = previous.get("attempts", 1) + 1
+
+        build = self.submit_build(srpm_path, chroots)
         if build is None:
-            self.state["builds"][srpm_name] = {
-                "status": "failed",
-                "reason": "submission error",
-                "submitted_at": now_iso(),
-                "mtime": mtime,
-            }
-            self.state["blocked_on"] = srpm_name
-            self.save_state()
+            self.set_build(
+                srpm_name,
+                {
+                    "status": "failed",
+                    "reason": "submission error",
+                    "submitted_at": now_iso(),
+                    "mtime": mtime,
+                    "attempts": attempts,
+                    **({"chroots": chroot_states} if self.chroots else {}),
+                },
+            )
+            self._build_failed(srpm_name)
             return False
 
-        self.state["builds"][srpm_name] = {
-            "status": "pending",
-            "copr_build_id": build.id,
-            "submitted_at": now_iso(),
-            "mtime": mtime,
-        }
-        self.save_state()
+        self.set_build(
+            srpm_name,
+            {
+                "status": "pending",
+                "copr_build_id": build.id,
+                "submitted_at": now_iso(),
+                "mtime": mtime,
+                "sha256": sha256,
+                "attempts": attempts,
+                **({"chroots": chroot_states} if self.chroots else {}),
+            },
+        )
+        self.inflight[srpm_name] = build.id
+        # New builds are checked soon, whatever the other builds wait for
+        self._next_poll = min(
+            self._next_poll,
+            time.monotonic() + min(self.poll_interval, POLL_FAST_SECONDS),
+        )
+        self.metrics.observe("copr_bridge_submit_delay_seconds", time.time() - mtime)
+        return True
 
-        result = self.poll_build(build.id)
+    def finish_build(self, srpm_name, result):
+        """Record the final result of an in-flight build. Return True on success."""
+        build_id = self.inflight.pop(srpm_name)
+        self._last_states.pop(build_id, None)
+        self._check_delays.pop(build_id, None)
+        reattached = srpm_name in self._reattached
+        self._reattached.discard(srpm_name)
+        self.metrics.inc(
+            "copr_bridge_builds_total", state=result.state if result else "lost"
+        )
 
         if result is None:
-            self.state["builds"][srpm_name]["status"] = "failed"
-            self.state["builds"][srpm_name]["reason"] = "poll failure or shutdown"
-            self.state["builds"][srpm_name]["completed_at"] = now_iso()
-            self.state["blocked_on"] = srpm_name
-            self.save_state()
+            self.update_build(
+                srpm_name,
+                status="failed",
+                reason="poll failure or build lost",
+                completed_at=now_iso(),
+            )
+            if not (reattached and self._resubmit(srpm_name)):
+                self._build_failed(srpm_name)
             return False
 
         build_url = "https://copr.fedorainfracloud.org/coprs/build/%d/" % result.id
+        entry = self.state["builds"][srpm_name]
 
-        if result.state == "succeeded":
-            self.state["builds"][srpm_name]["status"] = "succeeded"
-            self.state["builds"][srpm_name]["completed_at"] = now_iso()
-            self.state["last_succeeded"] = srpm_name
-            self.save_state()
+        failed_chroots = []
+        if "chroots" in entry:
+            chroot_states = dict(entry["chroots"])
+            submitted = [c for c, state in chroot_states.items() if state == "pending"]
+            chroot_states.update(self._chroot_results(result, submitted))
+            self.update_build(srpm_name, chroots=chroot_states)
+            failed_chroots = [
+                c for c, state in chroot_states.items() if state != "succeeded"
+            ]
+
+        if result.state == "succeeded" and not failed_chroots:
+            fields = {}
+            started_on = getattr(result, "started_on", None)
+            ended_on = getattr(result, "ended_on", None)
+            if started_on and ended_on:
+                fields["build_seconds"] = ended_on - started_on
+                self._record_duration(srpm_name, ended_on - started_on)
+            self.update_build(
+                srpm_name, status="succeeded", completed_at=now_iso(), **fields
+            )
+            self.set_state("last_succeeded", srpm_name)
+            if entry.get("sha256"):
+                for chroot in self._succeeded_chroots(entry):
+                    self._built_content[(entry["sha256"], chroot)] = srpm_name
+            self.succeeded_names.append(srpm_name)
+            self.failed_names.discard(srpm_name)
             logging.info("Build succeeded: %s (%s)", srpm_name, build_url)
             return True
 
-        self.state["builds"][srpm_name]["status"] = result.state
-        self.state["builds"][srpm_name]["completed_at"] = now_iso()
-        self.state["builds"][srpm_name]["build_url"] = build_url
-        self.state["blocked_on"] = srpm_name
-        self.save_state()
-        logging.error("Build %s for %s. See: %s", result.state, srpm_name, build_url)
+        self.update_build(
+            srpm_name,
+            status=result.state if result.state != "succeeded" else "failed",
+            completed_at=now_iso(),
+            build_url=build_url,
+        )
+        logging.error(
+            "Build %s for %s%s. See: %s",
+            entry["status"],
+            srpm_name,
+            " in %s" % ", ".join(failed_chroots) if failed_chroots else "",
+            build_url,
+        )
+        # A canceled build was stopped on purpose, anything else may be
+        # transient (builder timeouts, mirror glitches)
+        if entry["status"] == "canceled":
+            self._build_failed(srpm_name, retryable=False)
+        elif not (reattached and self._resubmit(srpm_name)):
+            self._build_failed(srpm_name)
         return False
 
+    def recover_inflight(self):
+        """Re-attach to the builds a previous run left pending in COPR.
+
+        Their SRPMs are tracked as in flight under their existing build
+        ids instead of being submitted again; builds that turn out failed,
+        unknown or lost are resubmitted once (see _resubmit).
+        """
+        if self.dryrun:
+            return
+        pending = {
+            srpm_name: entry["copr_build_id"]
+            for srpm_name, entry in self.state["builds"].items()
+            if entry["status"] == "pending" and entry.get("copr_build_id")
+        }
+        for srpm_name, build_id in pending.items():
+            if srpm_name not in self._srpm_info:
+                self._srpm_info[srpm_name] = self._read_srpm_info(
+                    Path(self.srpm_dir) / srpm_name
+                )
+            self.inflight[srpm_name] = build_id
+            self._reattached.add(srpm_name)
+            logging.info("Re-attaching to build %d of %s", build_id, srpm_name)
+        if pending:
+            self._next_poll = 0
+
+    def _resubmit(self, srpm_name):
+        """Queue a re-attached SRPM whose build did not succeed.
+
+        Returns False if the SRPM file is gone, leaving the failure to the
+        usual handling.
+        """
+        srpm_path = Path(self.srpm_dir) / srpm_name
+        if not srpm_path.exists():
+            return False
+        logging.warning(
+            "Resubmitting %s, its build from before the restart did not succeed",
+            srpm_name,
+        )
+        self.metrics.inc("copr_bridge_build_retries_total")
+        self._queue_again(srpm_path)
+        return True
+
+    def _chroot_results(self, result, chroots):
+        """Return {chroot: state} of a finished build for the given chroots."""
+        if result.state == "succeeded":
+            return {c: "succeeded" for c in chroots}
+        try:
+            build_chroots = self.limiter.call(
+                "status", self.client.build_chroot_proxy.get_list, result.id
+            )
+        except (CoprException, OSError) as e:
+            self.metrics.inc("copr_bridge_api_errors_total", operation="chroots")
+            logging.warning("Cannot get chroot states of build %d: %s", result.id, e)
+            return {c: result.state for c in chroots}
+        states = {bc.name: bc.state for bc in build_chroots}
+        return {c: states.get(c, result.state) for c in chroots}
+
+    def _done_chroots(self, entry):
+        """Return the chroots a state entry counts as built for.
+
+        Entries without per-chroot states were built (or found built) for
+        the chroots the state file was created with.
+        """
+        if "chroots" in entry:
+            return self._succeeded_chroots(entry)
+        built = entry.get("status") == "succeeded"
+        if not (built or entry.get("reason") in BUILT_REASONS):
+            return []
+        recorded = self.state.get("chroots") or [self.state.get("chroot")]
+        return [c for c in recorded if c is not None]
+
+    @staticmethod
+    def _succeeded_chroots(entry):
+        """Return the chroots a state entry has succeeded in.
+
+        Entries without per-chroot states count as one chroot, None for
+        the project's default chroots.
+        """
+        if "chroots" in entry:
+            return [c for c, state in entry["chroots"].items() if state == "succeeded"]
+        if entry.get("status") == "succeeded":
+            return [entry.get("chroot")]
+        return []
+
+    def _build_failed(self, srpm_name, retryable=True):
+        """Handle a failed build of an SRPM.
+
+        With --max-attempts above one, a retryable failure puts the SRPM
+        back into the queue, to be submitted again after an exponential
+        backoff while the other SRPMs keep flowing. An SRPM out of attempts
+        or with a canceled build becomes permanently failed, which only
+        holds back the SRPMs depending on it. Without retries, further
+        submissions are blocked on the SRPM unless --ignore-errors.
+        """
+        if self.max_attempts > 1:
+            entry = self.state["builds"][srpm_name]
+            attempts = entry.get("attempts", 1)
+            srpm_path = Path(self.srpm_dir) / srpm_name
+            if retryable and attempts < self.max_attempts and srpm_path.exists():
+                self._retry_later(srpm_path, attempts)
+                return
+            self.update_build(srpm_name, status="permanently-failed")
+            self.failed_names.add(srpm_name)
+            logging.error(
+                "%s failed permanently after %d attempt(s), holding back "
+                "the SRPMs that depend on it",
+                srpm_name,
+                attempts,
+            )
+            return
+
+        self.failed_names.add(srpm_name)
+        if self.ignore_errors:
+            self.set_state("blocked_on", None)
+        else:
+            self.set_state("blocked_on", srpm_name)
+            self._halted = True
+
+    def _retry_later(self, srpm_path, attempts):
+        """Queue a failed SRPM again, due after exponential backoff."""
+        srpm_name = srpm_path.name
+        delay = min(self.retry_backoff * 2 ** (attempts - 1), RETRY_BACKOFF_MAX_SECONDS)
+        self.update_build(srpm_name, retry_at=int(time.time() + delay))
+        self.metrics.inc("copr_bridge_build_retries_total")
+        logging.warning(
+            "Retrying %s in %ds (attempt %d of %d failed)",
+            srpm_name,
+            delay,
+            attempts,
+            self.max_attempts,
+        )
+        self._queue_again(srpm_path)
+
+    def _queue_again(self, srpm_path):
+        """Queue a failed SRPM for the chroots it has not succeeded in yet."""
+        succeeded = self._done_chroots(self.state["builds"][srpm_path.name])
+        self._target_chroots[srpm_path.name] = [
+            c for c in self.chroots or [None] if c not in succeeded
+        ]
+        self.queue_srpms([srpm_path])
+
+    def _retry_at(self, srpm_name):
+        """Return the time before which a queued SRPM must not be retried."""
+        return self.state["builds"].get(srpm_name, {}).get("retry_at", 0)
+
+    def next_retry(self):
+        """Return the time the next queued SRPM waiting to be retried is due."""
+        now = time.time()
+        return min(
+            (t for t in map(self._retry_at, self.queued_names) if t > now),
+            default=None,
+        )
+
+    def _read_srpm_info(self, srpm_path):
+        """Return (name, provides, requires, evr) from an SRPM header.
+
+        Falls back to the name and (epoch 0) version and release from the
+        file name, and no requirements, if the header cannot be read; evr
+        is None if the file name cannot be parsed either.
+        """
+        try:
+            header = RpmHeader(srpm_path)
+        except (OSError, ValueError, struct.error) as e:
+            logging.debug("Cannot read RPM header of %s: %s", srpm_path.name, e)
+            nvr = self._parse_srpm_nvr(srpm_path.name)
+            if nvr is None:
+                return (srpm_path.name, [], [], None)
+            return (nvr[0], [], [], (0, nvr[1], nvr[2]))
+
+        requires = [
+            r
+            for r in header.get(RpmHeader.TAG_REQUIRENAME, [])
+            if not r.startswith("rpmlib(")
+        ]
+        return (
+            header.get(RpmHeader.TAG_NAME),
+            header.get(RpmHeader.TAG_PROVIDENAME, []),
+            requires,
+            (
+                header.get(RpmHeader.TAG_EPOCH, [0])[0],
+                header.get(RpmHeader.TAG_VERSION),
+                header.get(RpmHeader.TAG_RELEASE),
+            ),
+        )
+
+    @staticmethod
+    def _resolve_provider(requirement, providers):
+        """Find the SRPM providing a BuildRequires entry, or None.
+
+        SRPM headers do not list binary subpackages, so a requirement like
+        'hwloc-ohpc-devel' falls back to the longest matching name prefix.
+        """
+        while requirement not in providers:
+            if "-" not in requirement:
+                return None
+            requirement = requirement.rsplit("-", 1)[0]
+        return providers[requirement]
+
+    def _supersede(self, srpm_path, newer_name):
+        """Record an SRPM as skipped in favour of a newer one of its package."""
+        logging.info("Skipping %s (superseded by %s)", srpm_path.name, newer_name)
+        self.set_build(
+            srpm_path.name,
+            {
+                "status": "skipped",
+                "reason": "superseded",
+                "superseded_by": newer_name,
+                "mtime": self._srpm_mtime(srpm_path),
+            },
+        )
+        self.skipped_names.append(srpm_path.name)
+        self._forget_srpm(srpm_path.name)
+
+    def _forget_srpm(self, srpm_name):
+        """Drop what is kept about an SRPM once it is neither queued nor in flight."""
+        if srpm_name in self.queued_names or srpm_name in self.inflight:
+            return
+        self._srpm_info.pop(srpm_name, None)
+        self._srpm_sha256.pop(srpm_name, None)
+        self._target_chroots.pop(srpm_name, None)
+
+    def _superseding_srpms(self):
+        """Map package names to the SRPMs that supersede older ones of them.
+
+        These are the SRPMs queued, in flight or built (or found built) in
+        COPR, and those in srpm_dir not decided on yet.
+        """
+        builds = self.state["builds"]
+        srpm_names = self.queued_names | set(self.inflight)
+        srpm_names.update(
+            srpm_name
+            for srpm_name, entry in builds.items()
+            if entry["status"] == "succeeded" or entry.get("reason") in BUILT_REASONS
+        )
+        srpm_names.update(
+            srpm_name
+            for srpm_name, outcome in self.state.get("archived", {}).items()
+            if outcome == "succeeded" or outcome in BUILT_REASONS
+        )
+        srpm_names.update(
+            srpm_name
+            for srpm_name in self.dir_index
+            if srpm_name not in builds and self.should_process(srpm_name)
+        )
+
+        packages = {}
+        for srpm_name in srpm_names:
+            nvr = self._parse_srpm_nvr(srpm_name)
+            if nvr is not None:
+                packages.setdefault(nvr[0], set()).add(srpm_name)
+        return packages
+
+    def _srpm_evr(self, srpm_name):
+        """Return the (epoch, version, release) of an SRPM, or None."""
+        info = self._srpm_info.get(srpm_name)
+        if info is None:
+            info = self._read_srpm_info(Path(self.srpm_dir) / srpm_name)
+        return info[3]
+
+    def queue_srpms(self, srpm_paths):
+        """Append SRPMs to the submission queue and update dependencies.
+
+        Only the newest SRPM of each package is kept, comparing epoch,
+        version and release from the headers: older ones, whether queued
+        already or arriving after a newer one was queued, submitted or
+        built, are recorded as superseded instead.
+        """
+        packages = self._superseding_srpms()
+        evrs = {}
+
+        def newest_first(a, b):
+            for srpm_name in (a, b):
+                if srpm_name not in evrs:
+                    evrs[srpm_name] = self._srpm_evr(srpm_name)
+            if evrs[a] is None or evrs[b] is None:
+                return 0
+            return compare_evr(evrs[b], evrs[a])
+
+        for srpm_path in srpm_paths:
+            if srpm_path.name not in self._srpm_info:
+                self._srpm_info[srpm_path.name] = self._read_srpm_info(srpm_path)
+            nvr = self._parse_srpm_nvr(srpm_path.name)
+            if nvr is not None:
+                others = sorted(
+                    packages.setdefault(nvr[0], set()) - {srpm_path.name},
+                    key=cmp_to_key(newest_first),
+                )
+                if others and newest_first(srpm_path.name, others[0]) >= 0:
+                    self._supersede(srpm_path, others[0])
+                    continue
+                if others and others[0] in self.queued_names:
+                    other = next(p for p in self.queue if p.name == others[0])
+                    self.queue.remove(other)
+                    self.queued_names.discard(others[0])
+                    self._srpm_sha256.pop(others[0], None)
+                    self._supersede(other, srpm_path.name)
+                packages[nvr[0]].add(srpm_path.name)
+
+            self.queue.append(srpm_path)
+            self.queued_names.add(srpm_path.name)
+        self._hash_srpms([p for p in self.queue if p.name not in self._srpm_sha256])
+        self._update_dependencies()
+
+    def _hash_srpms(self, srpm_paths):
+        """Compute the SHA-256 of SRPMs in a worker pool."""
+
+        def hash_one(srpm_path):
+            try:
+                return sha256_file(srpm_path)
+            except (OSError, ValueError) as e:
+                logging.warning("Cannot hash %s: %s", srpm_path.name, e)
+                return None
+
+        if not srpm_paths:
+            return
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            for srpm_path, sha256 in zip(srpm_paths, pool.map(hash_one, srpm_paths)):
+                self._srpm_sha256[srpm_path.name] = sha256
+
+    def preflight_srpms(self, srpm_paths):
+        """Validate SRPMs before they are queued, return the valid ones.
+
+        Several SRPMs are checked in parallel in a process pool (see
+        validate_srpm). Invalid SRPMs are recorded as such and not checked
+        again until their size or mtime changes; incomplete ones are
+        deferred until they are written completely, i.e. their next inotify
+        event or scan. Dry runs upload nothing and skip the check.
+        """
+        if self.dryrun or not srpm_paths:
+            return srpm_paths
+
+        checked = []
+        stats = {}
+        for srpm_path in srpm_paths:
+            entry = self.state["builds"].get(srpm_path.name, {})
+            # Stat afresh, as files rewritten in place keep their inode
+            try:
+                st = stats[srpm_path.name] = srpm_path.stat()
+            except FileNotFoundError:
+                self._target_chroots.pop(srpm_path.name, None)
+                continue
+            if (
+                entry.get("status") == "invalid"
+                and entry.get("size") == st.st_size
+                and entry.get("mtime") == st.st_mtime
+            ):
+                logging.debug("Skipping %s (still invalid)", srpm_path.name)
+                self._target_chroots.pop(srpm_path.name, None)
+                continue
+            checked.append(srpm_path)
+
+        results = None
+        if len(checked) > 1:
+            try:
+                if self._preflight_pool is None:
+                    # The bridge runs threads by now, which fork() does not
+                    # handle safely; a fork server is a fresh process
+                    self._preflight_pool = ProcessPoolExecutor(
+                        max_workers=PREFLIGHT_WORKERS,
+                        mp_context=multiprocessing.get_context("forkserver"),
+                    )
+                results = list(self._preflight_pool.map(validate_srpm, checked))
+            except (OSError, BrokenProcessPool) as e:
+                logging.warning("Cannot validate SRPMs in parallel: %s", e)
+                self.close()
+        if results is None:
+            results = [validate_srpm(srpm_path) for srpm_path in checked]
+
+        valid = []
+        for srpm_path, (verdict, detail, sha256) in zip(checked, results):
+            srpm_name = srpm_path.name
+            if verdict == "valid":
+                self._srpm_sha256[srpm_name] = sha256
+                valid.append(srpm_path)
+                continue
+            self._target_chroots.pop(srpm_name, None)
+            self.metrics.inc("copr_bridge_preflight_rejects_total", verdict=verdict)
+            if verdict == "incomplete":
+                logging.warning(
+                    "Deferring %s until it is written completely: %s",
+                    srpm_name,
+                    detail,
+                )
+                continue
+            logging.error("Not submitting invalid SRPM %s: %s", srpm_name, detail)
+            self.set_build(
+                srpm_name,
+                {
+                    "status": "invalid",
+                    "reason": detail,
+                    "mtime": stats[srpm_name].st_mtime,
+                    "size": stats[srpm_name].st_size,
+                },
+            )
+            self.failed_names.add(srpm_name)
+        return valid
+
+    def close(self):
+        """Stop the preflight worker processes, if started."""
+        if self._preflight_pool is not None:
+            self._preflight_pool.shutdown()
+            self._preflight_pool = None
+
+    def _update_dependencies(self):
+        """Map each queued SRPM to the pending SRPMs providing its BuildRequires."""
+        queued = [p.name for p in self.queue]
+        providers = {}
+        for srpm_name in queued + list(self.inflight):
+            name, provides, _, _ = self._srpm_info[srpm_name]
+            for capability in [name] + provides:
+                providers.setdefault(capability, srpm_name)
+
+        self.depends = {}
+        for srpm_name in queued:
+            deps = set()
+            for requirement in self._srpm_info[srpm_name][2]:
+                provider = self._resolve_provider(requirement, providers)
+                if provider is not None and provider != srpm_name:
+                    deps.add(provider)
+            self.depends[srpm_name] = deps
+
+        # Break dependency cycles among queued SRPMs: whatever cannot be
+        # ordered topologically falls back to queue (mtime) order.
+        remaining = {n: self.depends[n] & self.queued_names for n in queued}
+        while True:
+            done = [n for n, deps in remaining.items() if not deps]
+            if not done:
+                break
+            for n in done:
+                del remaining[n]
+            for deps in remaining.values():
+                deps.difference_update(done)
+        for srpm_name in remaining:
+            logging.warning(
+                "Dependency cycle involving %s, ignoring its BuildRequires on %s",
+                srpm_name,
+                ", ".join(sorted(remaining[srpm_name])),
+            )
+            self.depends[srpm_name] -= remaining.keys()
+        self._longest_first = None
+
+    def _critical_paths(self):
+        """Return the expected build time of each queued SRPM's longest chain.
+
+        The chain of an SRPM is the SRPM itself followed by the queued SRPMs
+        that (transitively) wait on it. Packages without recorded builds
+        count with the median of the known packages' expected durations, or
+        zero if none are known.
+        """
+        queued = [p.name for p in self.queue]
+        known = sorted(
+            durations[len(durations) // 2]
+            for durations in (sorted(d) for d in self._durations.values())
+            if durations
+        )
+        default = known[len(known) // 2] if known else 0
+
+        dependents = {srpm_name: [] for srpm_name in queued}
+        for srpm_name in queued:
+            for dep in self.depends.get(srpm_name, ()):
+                if dep in dependents:
+                    dependents[dep].append(srpm_name)
+
+        # Walk the (acyclic) dependency graph from the SRPMs nothing waits on
+        paths = {}
+        waiting = {n: len(dependents[n]) for n in queued}
+        stack = [n for n in queued if not waiting[n]]
+        while stack:
+            srpm_name = stack.pop()
+            expected = self._expected_duration(srpm_name)
+            paths[srpm_name] = (default if expected is None else expected) + max(
+                (paths[d] for d in dependents[srpm_name]), default=0
+            )
+            for dep in self.depends.get(srpm_name, ()):
+                if dep in waiting:
+                    waiting[dep] -= 1
+                    if not waiting[dep]:
+                        stack.append(dep)
+        return paths
+
+    def _next_ready(self):
+        """Return the next queued SRPM whose providers all succeeded, or None.
+
+        With --schedule mtime that is the first ready SRPM in queue order;
+        with longest-first it is the ready SRPM heading the longest expected
+        chain of builds, so long builds do not end up as stragglers.
+        """
+        order = self.queue
+        if self.schedule == "longest-first":
+            if self._longest_first is None:
+                self._paths = self._critical_paths()
+                self._longest_first = sorted(
+                    self.queue, key=lambda p: -self._paths.get(p.name, 0)
+                )
+            order = self._longest_first
+
+        now = time.time()
+        srpm_path = next(
+            (
+                srpm_path
+                for srpm_path in order
+                if self._retry_at(srpm_path.name) <= now
+                and not any(
+                    dep in self.queued_names
+                    or dep in self.inflight
+                    or dep in self.failed_names
+                    for dep in self.depends.get(srpm_path.name, ())
+                )
+            ),
+            None,
+        )
+        if srpm_path is not None and order is self._longest_first:
+            logging.debug(
+                "Next: %s, expected %ds until its dependents are built",
+                srpm_path.name,
+                self._paths.get(srpm_path.name, 0),
+            )
+        return srpm_path
+
+    def submit_one(self):
+        """Start the next ready SRPM if below --max-inflight. Return True if one was."""
+        if self._halted or self._shutdown or len(self.inflight) >= self.max_inflight:
+            return False
+        srpm_path = self._next_ready()
+        if srpm_path is None:
+            return False
+        self.queue.remove(srpm_path)
+        self.queued_names.discard(srpm_path.name)
+        # Submitting a ready SRPM leaves the other critical paths unchanged
+        if self._longest_first is not None:
+            self._longest_first.remove(srpm_path)
+        self.start_srpm(srpm_path)
+        self._forget_srpm(srpm_path.name)
+        return True
+
+    def submit_ready(self):
+        """Submit queued SRPMs until --max-inflight builds are running."""
+        while self.submit_one():
+            pass
+
+    def reap_finished(self):
+        """Poll in-flight builds if due and record the finished ones."""
+        if not self.inflight or time.monotonic() < self._next_poll:
+            return
+        for srpm_name, result in self.poll_inflight():
+            self.finish_build(srpm_name, result)
+            self._forget_srpm(srpm_name)
+        self._next_poll = time.monotonic() + self._poll_delay()
+
+    def drain_queue(self):
+        """Process the queue until it is empty and no builds are in flight."""
+        while not self._shutdown:
+            self.submit_ready()
+            if not self.inflight:
+                retry = self.next_retry()
+                if retry is None:
+                    break
+                time.sleep(min(max(0, retry - time.time()), SHUTDOWN_CHECK_SECONDS))
+                continue
+            self.reap_finished()
+            self.export_metrics()
+            if self.inflight:
+                self._wait_for_poll()
+
+        if self._shutdown:
+            self._leave_inflight()
+        elif not self._halted:
+            for srpm_path in self.queue:
+                logging.warning(
+                    "Not submitting %s: BuildRequires provider %s failed",
+                    srpm_path.name,
+                    ", ".join(sorted(self.depends[srpm_path.name] & self.failed_names)),
+                )
+
+    def _leave_inflight(self):
+        """On shutdown, leave in-flight builds pending for the next run."""
+        if self.inflight:
+            logging.info(
+                "Leaving %d build(s) in flight, to be re-attached on the next start",
+                len(self.inflight),
+            )
+
     @staticmethod
     def _parse_srpm_nvr(srpm_name):
         """Parse (name, version, release) from SRPM filename.
@@ -376,56 +2380,183 @@ class CoprBridge:
             return None
         return parts[0], parts[1], parts[2]
 
+    def _load_history(self):
+        """Load the cached COPR build history, return (last_build_id, builds).
+
+        builds maps (name, version-release) to the set of chroots built.
+        """
+        try:
+            with open(self.history_file) as f:
+                history = json.load(f)
+        except FileNotFoundError:
+            return 0, {}
+        except (json.JSONDecodeError, OSError) as e:
+            logging.warning("Failed to read COPR history %s: %s", self.history_file, e)
+            return 0, {}
+
+        if history.get("copr_project") != self.copr_project:
+            logging.info("COPR history %s is for another project", self.history_file)
+            return 0, {}
+        if any(len(b) != 3 for b in history["builds"]):
+            logging.info(
+                "COPR history %s has no chroots, refetching", self.history_file
+            )
+            return 0, {}
+        return history["last_build_id"], {
+            (name, version): set(chroots)
+            for name, version, chroots in history["builds"]
+        }
+
+    def _save_history(self, last_build_id, existing):
+        """Write the COPR build history cache atomically."""
+        tmp_path = self.history_file + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        "copr_project": self.copr_project,
+                        "last_build_id": last_build_id,
+                        "builds": sorted(
+                            [name, version, sorted(chroots)]
+                            for (name, version), chroots in existing.items()
+                        ),
+                    },
+                    f,
+                )
+            os.rename(tmp_path, self.history_file)
+        except OSError as e:
+            logging.error("Failed to save COPR history: %s", e)
+
+    def _fetch_history_page(self, offset):
+        """Fetch one page of project builds, newest first."""
+        return self.limiter.call(
+            "history",
+            self.client.build_proxy.get_list,
+            ownername=self.ownername,
+            projectname=self.projectname,
+            pagination={
+                "limit": HISTORY_PAGE_SIZE,
+                "offset": offset,
+                "order": "id",
+                "order_type": "DESC",
+            },
+        )
+
+    def _list_builds_since(self, last_build_id):
+        """Return all project builds with an id above last_build_id.
+
+        An incremental refresh is normally covered by the first page. COPR
+        does not report the total number of builds, so a full refresh
+        fetches the following pages in concurrent batches until one of them
+        comes back short. Builds added meanwhile only shift older builds to
+        later pages (newest first), so nothing is missed.
+        """
+
+        def last_page(page):
+            return len(page) < HISTORY_PAGE_SIZE or page[-1].id <= last_build_id
+
+        pages = [self._fetch_history_page(0)]
+        if not last_page(pages[0]):
+            offset = HISTORY_PAGE_SIZE
+            with ThreadPoolExecutor(max_workers=HISTORY_WORKERS) as pool:
+                while not last_page(pages[-1]):
+                    offsets = [
+                        offset + i * HISTORY_PAGE_SIZE for i in range(HISTORY_WORKERS)
+                    ]
+                    offset += HISTORY_WORKERS * HISTORY_PAGE_SIZE
+                    for page in pool.map(self._fetch_history_page, offsets):
+                        pages.append(page)
+                        if last_page(page):
+                            break
+
+        return [b for page in pages for b in page if b.id > last_build_id]
+
     def _fetch_existing_builds(self):
-        """Fetch successful builds from COPR, return set of (name, version-release)."""
+        """Fetch successful builds from COPR.
+
+        Returns a dict mapping (name, version-release) to the set of
+        chroots it was built for.
+
+        The set is cached in the history file together with a high-water
+        mark, so later calls only fetch builds newer than the mark.
+        """
         if self.client is None or self.force_rebuild:
-            return set()
+            return {}
 
-        logging.info("Checking existing builds in COPR %s ...", self.copr_project)
-        existing = set()
-        offset = 0
-        limit = 100
+        last_build_id, existing = self._load_history()
+        if last_build_id:
+            logging.info(
+                "Checking builds newer than %d in COPR %s ...",
+                last_build_id,
+                self.copr_project,
+            )
+        else:
+            logging.info("Checking existing builds in COPR %s ...", self.copr_project)
 
         try:
-            while True:
-                builds = self.client.build_proxy.get_list(
-                    ownername=self.ownername,
-                    projectname=self.projectname,
-                    pagination={"limit": limit, "offset": offset},
-                )
-                if not builds:
-                    break
-                for build in builds:
-                    if build.state != "succeeded":
-                        continue
-                    pkg = build.source_package
-                    if not pkg:
-                        continue
-                    name = pkg.get("name")
-                    version = pkg.get("version")
-                    if name and version:
-                        existing.add((name, version))
-                if len(builds) < limit:
-                    break
-                offset += limit
+            builds = self._list_builds_since(last_build_id)
         except (CoprException, OSError) as e:
+            self.metrics.inc("copr_bridge_api_errors_total", operation="history")
             logging.warning("Failed to fetch existing builds from COPR: %s", e)
+            if existing:
+                logging.warning("Proceeding with cached COPR builds only")
+                return existing
             logging.warning("Proceeding without COPR build check")
-            return set()
+            return {}
+
+        active = []
+        for build in builds:
+            if build.state in ACTIVE_STATES:
+                active.append(build.id)
+                continue
+            if build.state != "succeeded":
+                continue
+            pkg = build.source_package
+            if not pkg:
+                continue
+            name = pkg.get("name")
+            version = pkg.get("version")
+            if name and version:
+                existing.setdefault((name, version), set()).update(build.chroots or ())
+
+        # Builds still in progress may succeed later, so the mark must stay
+        # below the oldest of them to see them again on the next refresh.
+        if active:
+            last_build_id = min(active) - 1
+        elif builds:
+            last_build_id = max(b.id for b in builds)
+        self._save_history(last_build_id, existing)
 
         logging.info("Found %d unique successful builds in COPR", len(existing))
         return existing
 
-    def _already_in_copr(self, srpm_name, existing_builds):
-        """Check if an SRPM already has a successful build in COPR."""
-        if not existing_builds:
-            return False
+    def _missing_chroots(self, srpm_name, existing_builds):
+        """Return the chroots an SRPM still needs to be built for.
+
+        A chroot is done if COPR has a successful build of the same name
+        and version-release there, or if an earlier submission of this SRPM
+        succeeded in it. Without --chroot any successful build in COPR
+        counts, and [None] (the project's default chroots) is returned
+        otherwise.
+        """
+        built = set()
         nvr = self._parse_srpm_nvr(srpm_name)
         if nvr is None:
             logging.warning("Could not parse NVR from %s, will not skip", srpm_name)
-            return False
-        name, version, release = nvr
-        return (name, "%s-%s" % (version, release)) in existing_builds
+        else:
+            name, version, release = nvr
+            key = (name, "%s-%s" % (version, release))
+            if not self.chroots:
+                return [] if key in existing_builds else [None]
+            built.update(existing_builds.get(key, ()))
+        if not self.chroots:
+            return [None]
+
+        if not self.force_rebuild:
+            entry = self.state["builds"].get(srpm_name)
+            if entry is not None:
+                built.update(self._done_chroots(entry))
+        return [c for c in self.chroots if c not in built]
 
     def _auto_reset_blocked(self):
         """If processing is blocked on a failed SRPM, reset it automatically."""
@@ -438,205 +2569,177 @@ class CoprBridge:
                 "Auto-resetting previously failed SRPM '%s' for retry",
                 blocked,
             )
-            del self.state["builds"][blocked]
-        self.state["blocked_on"] = None
-        self.save_state()
+            self._reset_build(blocked)
+        self.set_state("blocked_on", None)
 
-    def run_scan(self):
-        """Scan mode: process all SRPMs in directory sorted by mtime."""
-        self._auto_reset_blocked()
+    def filter_srpm(self, srpm_path, existing_builds):
+        """Decide whether an SRPM needs a build, recording skips in state.
 
-        srpms = self.scan_srpms()
-        existing_builds = self._fetch_existing_builds()
-        succeeded_names = []
-        skipped_names = []
-        failed_names = []
+        Returns True if the SRPM should be queued for submission.
+        """
+        srpm_name = srpm_path.name
 
-        for srpm_path in srpms:
-            if self._shutdown:
-                logging.info("Shutdown requested, stopping scan")
-                break
+        if srpm_name in self.inflight:
+            logging.debug("Skipping %s (already in flight)", srpm_name)
+            return False
 
-            srpm_name = srpm_path.name
+        if self.already_processed(srpm_name):
+            entry = self.state["builds"].get(srpm_name)
+            status = entry["status"] if entry else "archived"
+            logging.debug("Skipping %s (already %s)", srpm_name, status)
+            self.skipped_names.append(srpm_name)
+            return False
 
-            if self.already_processed(srpm_name):
-                status = self.state["builds"][srpm_name]["status"]
-                logging.debug("Skipping %s (already %s)", srpm_name, status)
-                skipped_names.append(srpm_name)
-                continue
+        if srpm_name in self.queued_names:
+            logging.debug("Skipping %s (already queued)", srpm_name)
+            return False
 
-            if not self.should_process(srpm_name):
-                self.state["builds"][srpm_name] = {
+        if not self.should_process(srpm_name):
+            self.set_build(
+                srpm_name,
+                {
                     "status": "skipped",
                     "reason": "filtered",
-                    "mtime": srpm_path.stat().st_mtime,
-                }
-                self.save_state()
-                skipped_names.append(srpm_name)
-                continue
+                    "mtime": self._srpm_mtime(srpm_path),
+                },
+            )
+            self.skipped_names.append(srpm_name)
+            return False
 
-            if self._already_in_copr(srpm_name, existing_builds):
-                logging.info("Skipping %s (already built in COPR)", srpm_name)
-                self.state["builds"][srpm_name] = {
+        chroots = self._missing_chroots(srpm_name, existing_builds)
+        if not chroots:
+            logging.info("Skipping %s (already built in COPR)", srpm_name)
+            self.set_build(
+                srpm_name,
+                {
                     "status": "skipped",
                     "reason": "already-in-copr",
-                    "mtime": srpm_path.stat().st_mtime,
-                }
-                self.save_state()
-                skipped_names.append(srpm_name)
-                continue
+                    "mtime": self._srpm_mtime(srpm_path),
+                    **(
+                        {"chroots": dict.fromkeys(self.chroots, "succeeded")}
+                        if self.chroots
+                        else {}
+                    ),
+                },
+            )
+            self.skipped_names.append(srpm_name)
+            return False
 
-            ok = self.process_srpm(srpm_path)
-            if ok:
-                succeeded_names.append(srpm_name)
-            else:
-                failed_names.append(srpm_name)
-                if self.ignore_errors:
-                    self.state["blocked_on"] = None
-                    self.save_state()
-                    continue
-                break
+        if chroots != (self.chroots or [None]):
+            logging.info(
+                "Building %s only for %s (already built for the other chroots)",
+                srpm_name,
+                ", ".join(chroots),
+            )
+        self._target_chroots[srpm_name] = chroots
+        return True
+
+    def run_scan(self):
+        """Scan mode: process all SRPMs in directory in dependency order.
+
+        SRPMs without dependencies between them are processed in mtime order,
+        or longest expected build first with --schedule longest-first.
+        """
+        self._auto_reset_blocked()
+        self.recover_inflight()
+
+        srpms = self.scan_srpms()
+        existing_builds = self._fetch_existing_builds()
+
+        self.queue_srpms(
+            self.preflight_srpms(
+                [p for p in srpms if self.filter_srpm(p, existing_builds)]
+            )
+        )
+
+        self.drain_queue()
+        if self._shutdown:
+            logging.info("Shutdown requested, stopping scan")
 
         logging.info(
             "Scan complete: %d succeeded, %d skipped, %d failed (of %d total)",
-            len(succeeded_names),
-            len(skipped_names),
-            len(failed_names),
+            len(self.succeeded_names),
+            len(self.skipped_names),
+            len(self.failed_names),
             len(srpms),
         )
-        if succeeded_names:
+        if self.succeeded_names:
             logging.info("  Succeeded:")
-            for name in succeeded_names:
+            for name in self.succeeded_names:
                 logging.info("    - %s", name)
-        if skipped_names:
+        if self.skipped_names:
             logging.info("  Skipped:")
-            for name in skipped_names:
+            for name in self.skipped_names:
                 logging.info("    - %s", name)
-        if failed_names:
+        if self.failed_names:
             logging.info("  Failed:")
-            for name in failed_names:
+            for name in sorted(self.failed_names):
                 logging.info("    - %s", name)
 
-    def run_watch(self):
-        """Watch mode: initial scan then inotify event loop."""
-        # Run initial scan first
-        logging.info("Running initial scan before entering watch mode")
-        self._auto_reset_blocked()
+    def _scan_new_srpms(self, existing_builds):
+        """Scan srpm_dir and return the SRPMs that should be queued."""
+        return self.preflight_srpms(
+            [p for p in self.scan_srpms() if self.filter_srpm(p, existing_builds)]
+        )
 
-        srpms = self.scan_srpms()
-        existing_builds = self._fetch_existing_builds()
-        for srpm_path in srpms:
-            if self._shutdown:
-                return
-            srpm_name = srpm_path.name
-            if self.already_processed(srpm_name):
+    def _queue_arrivals(self, names, existing_builds):
+        """Queue the SRPMs among newly arrived file names that need a build."""
+        new_srpms = []
+        for name in names:
+            srpm_path = Path(self.srpm_dir) / name
+            if not self.index_srpm(srpm_path):
                 continue
-            if not self.should_process(srpm_name):
-                self.state["builds"][srpm_name] = {
-                    "status": "skipped",
-                    "reason": "filtered",
-                    "mtime": srpm_path.stat().st_mtime,
-                }
-                self.save_state()
-                continue
-            if self._already_in_copr(srpm_name, existing_builds):
-                logging.info("Skipping %s (already built in COPR)", srpm_name)
-                self.state["builds"][srpm_name] = {
-                    "status": "skipped",
-                    "reason": "already-in-copr",
-                    "mtime": srpm_path.stat().st_mtime,
-                }
-                self.save_state()
-                continue
-            if not self.process_srpm(srpm_path):
-                if self.ignore_errors:
-                    self.state["blocked_on"] = None
-                    self.save_state()
-                    continue
-                ERROR(
-                    "Build failed during initial scan. "
-                    "Fix and restart with --reset-failed."
-                )
-
-        # Set up inotify
-        watcher = InotifyWatcher()
-        mask = InotifyWatcher.IN_CLOSE_WRITE | InotifyWatcher.IN_MOVED_TO
-        watcher.add_watch(self.srpm_dir, mask)
-        logging.info("Watching %s for new SRPMs...", self.srpm_dir)
-
-        try:
-            while not self._shutdown:
-                for _wd, _mask, _cookie, name in watcher.read_events():
-                    if self._shutdown:
-                        break
-                    if not name.endswith(".src.rpm"):
-                        continue
+            if self.filter_srpm(srpm_path, existing_builds):
+                logging.info("New SRPM detected: %s", srpm_path.name)
+                new_srpms.append(srpm_path)
+        new_srpms = self.preflight_srpms(new_srpms)
+        if new_srpms:
+            self.queue_srpms(new_srpms)
 
-                    # Brief delay to let file writes settle
-                    time.sleep(0.5)
-
-                    srpm_path = Path(self.srpm_dir) / name
-                    if not srpm_path.exists():
-                        continue
-
-                    srpm_name = srpm_path.name
-                    if self.already_processed(srpm_name):
-                        logging.debug("Already processed %s, ignoring", srpm_name)
-                        continue
-                    if not self.should_process(srpm_name):
-                        self.state["builds"][srpm_name] = {
-                            "status": "skipped",
-                            "reason": "filtered",
-                            "mtime": srpm_path.stat().st_mtime,
-                        }
-                        self.save_state()
-                        continue
-
-                    if self._already_in_copr(srpm_name, existing_builds):
-                        logging.info(
-                            "Skipping %s (already built in COPR)",
-                            srpm_name,
-                        )
-                        self.state["builds"][srpm_name] = {
-                            "status": "skipped",
-                            "reason": "already-in-copr",
-                            "mtime": srpm_path.stat().st_mtime,
-                        }
-                        self.save_state()
-                        continue
+    def run_watch(self):
+        """Watch mode: initial scan then inotify event loop."""
+        BridgeDaemon(
+            [self], self.max_inflight, exit_on_halt=True, notifier=self.notifier
+        ).run()
 
-                    logging.info("New SRPM detected: %s", srpm_name)
-                    if not self.process_srpm(srpm_path):
-                        if self.ignore_errors:
-                            self.state["blocked_on"] = None
-                            self.save_state()
-                            continue
-                        ERROR(
-                            "Build failed for %s. "
-                            "Fix and restart with --reset-failed." % srpm_name
-                        )
-        finally:
-            watcher.close()
+    def _reset_build(self, srpm_name):
+        """Drop a failed SRPM from state, remembering chroots that succeeded."""
+        entry = self.state["builds"][srpm_name]
+        succeeded = self._succeeded_chroots(entry)
+        if succeeded:
+            self.set_build(
+                srpm_name,
+                {
+                    "status": "reset",
+                    "chroots": {c: "succeeded" for c in succeeded},
+                    "mtime": entry.get("mtime"),
+                },
+            )
+        else:
+            self.delete_build(srpm_name)
 
     def reset_failed(self, srpm_name):
-        """Remove a failed SRPM from state so it will be retried."""
+        """Remove a failed or invalid SRPM from state so it will be retried."""
         if srpm_name not in self.state["builds"]:
             ERROR("SRPM '%s' not found in state file" % srpm_name)
 
         entry = self.state["builds"][srpm_name]
-        if entry["status"] not in ("failed", "canceled"):
+        if entry["status"] not in (
+            "failed",
+            "canceled",
+            "permanently-failed",
+            "invalid",
+        ):
             ERROR(
-                "SRPM '%s' has status '%s', not failed/canceled"
+                "SRPM '%s' has status '%s', not failed/canceled/invalid"
                 % (srpm_name, entry["status"])
             )
 
         old_status = entry["status"]
-        del self.state["builds"][srpm_name]
+        self._reset_build(srpm_name)
 
         if self.state["blocked_on"] == srpm_name:
-            self.state["blocked_on"] = None
-
-        self.save_state()
+            self.set_state("blocked_on", None)
         logging.info(
             "Removed '%s' (was '%s') from state. It will be retried on next run.",
             srpm_name,
@@ -655,25 +2758,322 @@ class CoprBridge:
         signal.signal(signal.SIGTERM, handler)
 
 
+class BridgeDaemon:
+    """Run the watch mode of one or more bridges on an asyncio event loop.
+
+    Inotify readiness, per-file debounce timers, the poll and history
+    timers and SIGINT/SIGTERM are all handled on the loop, so events are
+    never left unread and shutdown requests take effect at once. COPR
+    calls and other blocking work run one at a time in a worker thread,
+    so no bridge state is ever modified concurrently.
+
+    The bridges share one inotify instance and the notifier, if any.
+    Free build slots are handed out round-robin, so that no bridge starves
+    the others, while at most max_inflight builds are in flight in total.
+    """
+
+    def __init__(self, bridges, max_inflight, exit_on_halt=False, notifier=None):
+        self.bridges = bridges
+        self.max_inflight = max_inflight
+        self.exit_on_halt = exit_on_halt
+        self.notifier = notifier
+        self._order = deque(bridges)
+        self._halted = set()
+
+    def setup_signal_handlers(self):
+        """Register handlers for graceful shutdown on SIGINT/SIGTERM."""
+
+        def handler(signum, _frame):
+            self._shutdown(signum)
+
+        signal.signal(signal.SIGINT, handler)
+        signal.signal(signal.SIGTERM, handler)
+
+    def _shutdown(self, signum):
+        signame = signal.Signals(signum).name
+        logging.info("Received %s, shutting down gracefully...", signame)
+        for bridge in self.bridges:
+            bridge._shutdown = True
+
+    @property
+    def shutdown_requested(self):
+        return any(bridge._shutdown for bridge in self.bridges)
+
+    def run(self):
+        """Watch all bridges' SRPM directories until shutdown."""
+        watcher = InotifyWatcher()
+        mask = InotifyWatcher.IN_CLOSE_WRITE | InotifyWatcher.IN_MOVED_TO
+        watches = {}
+        for bridge in self.bridges:
+            watches[watcher.add_watch(bridge.srpm_dir, mask)] = bridge
+        try:
+            asyncio.run(self._run(watcher, watches))
+        finally:
+            watcher.close()
+            # Closing the event loop dropped its signal handlers
+            self.setup_signal_handlers()
+            for bridge in self.bridges:
+                if bridge._shutdown:
+                    bridge._leave_inflight()
+
+    def _submit_fairly(self):
+        """Hand out free build slots round-robin across the bridges."""
+        inflight = sum(len(bridge.inflight) for bridge in self.bridges)
+        progress = True
+        while progress and inflight < self.max_inflight:
+            progress = False
+            for bridge in list(self._order):
+                if inflight >= self.max_inflight:
+                    break
+                if bridge.submit_one():
+                    # The bridge that just got a slot queues up behind the rest
+                    self._order.remove(bridge)
+                    self._order.append(bridge)
+                    inflight = sum(len(b.inflight) for b in self.bridges)
+                    progress = True
+
+    def _check_halted(self):
+        """Report bridges stopped by a failed build; exit if none is left."""
+        for bridge in self.bridges:
+            if not bridge._halted or bridge.inflight or bridge in self._halted:
+                continue
+            message = (
+                "Build failed for %s. Fix and restart with --reset-failed."
+                % bridge.state["blocked_on"]
+            )
+            if self.exit_on_halt:
+                ERROR(message)
+            logging.error("%s: %s", bridge.copr_project, message)
+            self._halted.add(bridge)
+        if len(self._halted) == len(self.bridges):
+            ERROR("All pipelines stopped on failed builds")
+
+    async def _run(self, watcher, watches):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1)
+        wakeup = asyncio.Event()
+        debounce = {}
+        arrived = {bridge: {} for bridge in self.bridges}
+        notified = set()
+        overflow = False
+
+        def blocking(func, *args):
+            return loop.run_in_executor(executor, func, *args)
+
+        def shutdown(signum):
+            self._shutdown(signum)
+            wakeup.set()
+
+        def settled(bridge, name):
+            del debounce[(bridge, name)]
+            arrived[bridge][name] = None
+            wakeup.set()
+
+        def readable():
+            nonlocal overflow
+            for wd, mask, _cookie, name in watcher.read_events(0):
+                if mask & InotifyWatcher.IN_Q_OVERFLOW:
+                    # Events were lost; the rescan covers all pending names
+                    overflow = True
+                    for handle in debounce.values():
+                        handle.cancel()
+                    debounce.clear()
+                    wakeup.set()
+                elif wd in watches and name.endswith(".src.rpm"):
+                    key = (watches[wd], name)
+                    if key in debounce:
+                        debounce[key].cancel()
+                    debounce[key] = loop.call_later(
+                        INTAKE_DEBOUNCE_SECONDS, settled, *key
+                    )
+
+        def notification():
+            notified.update(self.notifier.read_build_ids())
+            if notified:
+                wakeup.set()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, shutdown, signum)
+        loop.add_reader(watcher.fileno(), readable)
+        if self.notifier is not None:
+            loop.add_reader(self.notifier.fileno(), notification)
+
+        try:
+            existing_builds = {}
+            history_due = {}
+            for bridge in self.bridges:
+                logging.info("Running initial scan of %s", bridge.srpm_dir)
+                await blocking(bridge._auto_reset_blocked)
+                await blocking(bridge.recover_inflight)
+                existing_builds[bridge] = await blocking(bridge._fetch_existing_builds)
+                srpms = await blocking(bridge._scan_new_srpms, existing_builds[bridge])
+                await blocking(bridge.queue_srpms, srpms)
+                history_due[bridge] = time.monotonic() + bridge.history_refresh
+                logging.info("Watching %s for new SRPMs...", bridge.srpm_dir)
+
+            while not self.shutdown_requested:
+                # Reap before submitting, so that freed slots are refilled
+                # before waiting for the next event or poll
+                if notified:
+                    build_ids = list(notified)
+                    notified.clear()
+                    for bridge in self.bridges:
+                        await blocking(bridge.notify_builds, build_ids)
+                for bridge in self.bridges:
+                    await blocking(bridge.reap_finished)
+                await blocking(self._submit_fairly)
+                for bridge in self.bridges:
+                    await blocking(bridge.export_metrics)
+                    # Only scan mode prints a summary of these
+                    bridge.succeeded_names.clear()
+                    bridge.skipped_names.clear()
+                self._check_halted()
+
+                for bridge in self.bridges:
+                    if time.monotonic() >= history_due[bridge]:
+                        existing_builds[bridge] = await blocking(
+                            bridge._fetch_existing_builds
+                        )
+                        history_due[bridge] = time.monotonic() + bridge.history_refresh
+
+                if not (
+                    any(arrived.values())
+                    or notified
+                    or overflow
+                    or self.shutdown_requested
+                ):
+                    timeout = min(history_due.values()) - time.monotonic()
+                    for bridge in self.bridges:
+                        if bridge.inflight:
+                            timeout = min(timeout, bridge._next_poll - time.monotonic())
+                        retry = bridge.next_retry()
+                        if retry is not None:
+                            timeout = min(timeout, retry - time.time())
+                    wakeup.clear()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), max(0, timeout))
+                    except asyncio.TimeoutError:
+                        pass
+                if self.shutdown_requested:
+                    break
+
+                if overflow:
+                    overflow = False
+                    for bridge in self.bridges:
+                        arrived[bridge].clear()
+                        logging.warning(
+                            "Inotify event queue overflowed, rescanning %s",
+                            bridge.srpm_dir,
+                        )
+                        srpms = await blocking(
+                            bridge._scan_new_srpms, existing_builds[bridge]
+                        )
+                        await blocking(bridge.queue_srpms, srpms)
+                    continue
+
+                for bridge in self.bridges:
+                    if arrived[bridge]:
+                        names = list(arrived[bridge])
+                        arrived[bridge].clear()
+                        await blocking(
+                            bridge._queue_arrivals, names, existing_builds[bridge]
+                        )
+        finally:
+            loop.remove_reader(watcher.fileno())
+            if self.notifier is not None:
+                loop.remove_reader(self.notifier.fileno())
+            for handle in debounce.values():
+                handle.cancel()
+            executor.shutdown()
+
+
+def load_pipelines(config_file, args):
+    """Read the --mode daemon config, return (max_inflight, [args per pipeline]).
+
+    The config is a JSON object with a "pipelines" list. Each pipeline
+    sets command line options of one bridge by their long name (e.g.
+    "srpm_dir", "copr_project", "chroot", "state_file") and inherits the
+    others from the command line. An optional top-level "max_inflight"
+    caps the builds in flight across all pipelines; by default it is the
+    sum of the pipelines' own limits. Pipelines need their own state file
+    and SRPM directory.
+    """
+    try:
+        with open(config_file) as f:
+            config = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        ERROR("Cannot read config file %s: %s" % (config_file, e))
+
+    # Options that apply to the whole process, not to single pipelines
+    global_options = (
+        "mode",
+        "config",
+        "copr_config",
+        "reset_failed",
+        "notify",
+        "api_rate",
+        "metrics_port",
+        "debug",
+    )
+    list_options = ("chroots", "skip_pattern", "include_pattern")
+
+    pipelines = []
+    for number, pipeline in enumerate(config.get("pipelines", []), 1):
+        values = dict(vars(args))
+        for key, value in pipeline.items():
+            key = key.replace("-", "_")
+            if key == "chroot":
+                key = "chroots"
+            if key not in values or key in global_options:
+                ERROR(
+                    "Unknown option '%s' in pipeline %d of %s"
+                    % (key, number, config_file)
+                )
+            if key in list_options and isinstance(value, str):
+                value = [value]
+            values[key] = value
+        if not (values["srpm_dir"] and values["copr_project"]):
+            ERROR(
+                "Pipeline %d of %s needs srpm_dir and copr_project"
+                % (number, config_file)
+            )
+        pipelines.append(argparse.Namespace(**values))
+
+    if not pipelines:
+        ERROR("No pipelines defined in %s" % config_file)
+    state_files = [os.path.abspath(p.state_file) for p in pipelines]
+    if len(set(state_files)) != len(state_files):
+        ERROR("Pipelines in %s must use distinct state files" % config_file)
+    srpm_dirs = [os.path.realpath(p.srpm_dir) for p in pipelines]
+    if len(set(srpm_dirs)) != len(srpm_dirs):
+        ERROR("Pipelines in %s must use distinct SRPM directories" % config_file)
+
+    max_inflight = config.get(
+        "max_inflight", sum(pipeline.max_inflight for pipeline in pipelines)
+    )
+    return max_inflight, pipelines
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Bridge OBS SRPMs to Fedora COPR for ppc64le builds",
     )
     parser.add_argument(
         "--srpm-dir",
-        required=True,
         help="path to directory containing SRPMs",
         type=str,
     )
     parser.add_argument(
         "--copr-project",
-        required=True,
         help="COPR project (e.g. @openhpc/ohpc-ppc64le)",
         type=str,
     )
     parser.add_argument(
         "--chroot",
-        help="COPR chroot to build for (default: all project chroots)",
+        dest="chroots",
+        action="append",
+        help="COPR chroot to build for; repeat to build each SRPM for several "
+        "chroots from a single submission (default: all project chroots)",
         type=str,
     )
     parser.add_argument(
@@ -684,9 +3084,9 @@ def main():
     )
     parser.add_argument(
         "--mode",
-        choices=["scan", "watch"],
+        choices=["scan", "watch", "daemon"],
         default="scan",
-        help="operation mode (default: scan)",
+        help="operation mode; daemon watches all pipelines of --config (default: scan)",
         type=str,
     )
     parser.add_argument(
@@ -703,7 +3103,7 @@ def main():
     )
     parser.add_argument(
         "--reset-failed",
-        help="reset a failed SRPM to allow processing to continue",
+        help="reset a failed or invalid SRPM to allow processing to continue",
         type=str,
     )
     parser.add_argument(
@@ -727,9 +3127,106 @@ def main():
     parser.add_argument(
         "--poll-interval",
         default=60,
-        help="seconds between COPR build status polls (default: 60)",
+        help="seconds between COPR build status polls; builds that have "
+        "not started yet or whose expected duration is known from earlier "
+        "builds are polled adaptively (default: 60)",
+        type=int,
+    )
+    parser.add_argument(
+        "--max-inflight",
+        default=1,
+        help="maximum number of COPR builds in flight at once (default: 1)",
+        type=int,
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=["mtime", "longest-first"],
+        default="mtime",
+        help="order in which SRPMs whose BuildRequires are met get submitted; "
+        "longest-first starts the builds expected to take longest, including "
+        "the builds waiting on them, first (default: mtime)",
+        type=str,
+    )
+    parser.add_argument(
+        "--max-attempts",
+        default=1,
+        help="submit a failed SRPM up to this many times, with exponential "
+        "backoff, while the other SRPMs keep flowing; SRPMs still failing "
+        "then only hold back their dependents (default: 1, no retries)",
+        type=int,
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        default=300,
+        help="seconds before the first retry of a failed SRPM, doubled for "
+        "every further attempt (default: 300)",
         type=int,
     )
+    parser.add_argument(
+        "--history-refresh",
+        default=3600,
+        help="seconds between refreshes of the cached COPR build history "
+        "in watch mode (default: 3600)",
+        type=int,
+    )
+    parser.add_argument(
+        "--retention-days",
+        help="move succeeded and skipped state entries older than DAYS to "
+        "compressed archive segments next to the state file (default: keep)",
+        metavar="DAYS",
+        type=int,
+    )
+    parser.add_argument(
+        "--retention-releases",
+        help="move succeeded and skipped state entries of all but the newest "
+        "N releases of each package to the archive (default: keep)",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--srpm-base-url",
+        help="URL under which --srpm-dir is published; COPR then fetches "
+        "SRPMs from there instead of having them uploaded (default: upload)",
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics; in "
+        "daemon mode those of all pipelines, labeled by copr_project and "
+        "srpm_dir (default: disabled)",
+        type=int,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="write Prometheus metrics to this file, e.g. for the "
+        "node_exporter textfile collector (default: disabled)",
+        type=str,
+    )
+    parser.add_argument(
+        "--api-rate",
+        action="append",
+        default=[],
+        help="limit COPR API requests of a budget (submit, status or history) "
+        "to RATE per second, shared by all pipelines; rates are halved on "
+        "throttling or server errors and recover gradually (repeatable, "
+        "default: %s)" % ",".join("%s=%g" % item for item in API_RATES.items()),
+        metavar="BUDGET=RATE",
+        type=api_rate,
+    )
+    parser.add_argument(
+        "--notify",
+        help="receive COPR build notifications from a local relay, e.g. "
+        "unix:/run/copr_bridge.sock for JSON datagrams on a unix socket; "
+        "in-flight builds are then polled when notified and otherwise only "
+        "every %d seconds (default: poll only)" % NOTIFY_POLL_SECONDS,
+        metavar="SCHEME:ADDRESS",
+        type=str,
+    )
+    parser.add_argument(
+        "--config",
+        help="JSON file listing the pipelines for --mode daemon",
+        type=str,
+    )
     parser.add_argument(
         "--copr-config",
         help="path to COPR config file (default: ~/.config/copr)",
@@ -745,6 +3242,25 @@ def main():
     parser.set_defaults(dryrun=False, ignore_errors=False, force_rebuild=False)
     args = parser.parse_args()
 
+    if args.mode == "daemon":
+        if not args.config:
+            parser.error("--mode daemon requires --config")
+        if args.reset_failed:
+            parser.error("--reset-failed cannot be used with --mode daemon")
+    elif not (args.srpm_dir and args.copr_project):
+        parser.error("the following arguments are required: --srpm-dir, --copr-project")
+    if args.max_inflight < 1:
+        parser.error("--max-inflight must be at least 1")
+    if args.max_attempts < 1:
+        parser.error("--max-attempts must be at least 1")
+    if args.retention_days is not None and args.retention_days < 0:
+        parser.error("--retention-days must not be negative")
+    if args.retention_releases is not None and args.retention_releases < 1:
+        parser.error("--retention-releases must be at least 1")
+    base_url_scheme = urllib.parse.urlsplit(args.srpm_base_url or "").scheme
+    if args.srpm_base_url and base_url_scheme not in ("http", "https"):
+        parser.error("--srpm-base-url must be an http:// or https:// URL")
+
     def loglevel(debug):
         if debug:
             return "DEBUG"
@@ -752,17 +3268,58 @@ def main():
 
     coloredlogs.install(level=loglevel(args.debug), fmt="%(message)s")
 
-    bridge = CoprBridge(args)
-    bridge.setup_signal_handlers()
-
-    if args.reset_failed:
-        bridge.reset_failed(args.reset_failed)
+    if args.mode == "daemon":
+        max_inflight, pipelines = load_pipelines(args.config, args)
+        client = None
+        if not all(pipeline.dryrun for pipeline in pipelines):
+            client = create_client(args)
+        limiter = RateLimiter(dict(args.api_rate))
+        bridges = [CoprBridge(pipeline, client, limiter) for pipeline in pipelines]
+        if args.metrics_port:
+            metrics = Metrics()
+            for bridge in bridges:
+                bridge.metrics.labels = (
+                    ("copr_project", bridge.copr_project),
+                    ("srpm_dir", bridge.srpm_dir),
+                )
+                metrics.include(bridge.metrics)
+            metrics.serve(args.metrics_port)
+        notifier = create_notifier(args.notify) if args.notify else None
+        for bridge in bridges:
+            bridge.notifier = notifier
+        daemon = BridgeDaemon(bridges, max_inflight, notifier=notifier)
+        daemon.setup_signal_handlers()
+        try:
+            daemon.run()
+        finally:
+            for bridge in bridges:
+                bridge.save_state()
+                bridge.export_metrics()
+                bridge.close()
+            if notifier is not None:
+                notifier.close()
         return
 
-    if args.mode == "scan":
-        bridge.run_scan()
-    elif args.mode == "watch":
-        bridge.run_watch()
+    bridge = CoprBridge(args)
+    bridge.setup_signal_handlers()
+    if args.metrics_port:
+        bridge.metrics.serve(args.metrics_port)
+    if args.notify and not args.reset_failed:
+        bridge.notifier = create_notifier(args.notify)
+
+    try:
+        if args.reset_failed:
+            bridge.reset_failed(args.reset_failed)
+        elif args.mode == "scan":
+            bridge.run_scan()
+        elif args.mode == "watch":
+            bridge.run_watch()
+    finally:
+        bridge.save_state()
+        bridge.export_metrics()
+        bridge.close()
+        if bridge.notifier is not None:
+            bridge.notifier.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+#
+# In-process stand-in for the copr.v3 Client used by copr_bridge.py, with
+# configurable build durations, failure rate and API latency, so that the
+# bridge can be tested and benchmarked without Fedora COPR:
+#
+#   fake_copr.py [fake COPR options] -- [copr_bridge.py options]
+# --
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from types import SimpleNamespace
+
+from copr.v3.exceptions import CoprNoResultException, CoprRequestException
+
+import copr_bridge
+
+# Chroots of the fake project, used for builds submitted without chroots
+DEFAULT_CHROOTS = ("fedora-rawhide-ppc64le",)
+
+
+def write_srpm(path, name, version, release, requires=(), size=0):
+    """Write a minimal SRPM (lead, headers and size bytes of payload).
+
+    Like rpmbuild, it records the header+payload size and the header
+    SHA-256 in the signature and the payload SHA-256 in the main header.
+    """
+
+    def header(tags):
+        index, store = b"", b""
+        for tag, values in tags:
+            if isinstance(values, int):
+                store += b"\0" * (-len(store) % 4)
+                index += struct.pack(">iiii", tag, 4, len(store), 1)
+                store += struct.pack(">i", values)
+                continue
+            tag_type = 6 if len(values) == 1 and tag < 1003 or tag == 273 else 8
+            index += struct.pack(">iiii", tag, tag_type, len(store), len(values))
+            store += b"".join(v.encode() + b"\0" for v in values)
+        intro = b"\x8e\xad\xe8\x01\0\0\0\0" + struct.pack(">ii", len(tags), len(store))
+        return intro + index + store
+
+    payload = b"\0" * size
+    tags = [(1000, [name]), (1001, [version]), (1002, [release])]
+    if requires:
+        tags.append((1049, list(requires)))
+    tags += [(5092, [hashlib.sha256(payload).hexdigest()]), (5093, 8)]
+    main = header(tags)
+    signature = header(
+        [(1000, len(main) + size), (273, [hashlib.sha256(main).hexdigest()])]
+    )
+    with open(path, "wb") as f:
+        f.write(b"\xed\xab\xee\xdb\x03\x00\x00\x01" + b"\0" * 88)
+        f.write(signature + b"\0" * (-len(signature) % 8))
+        f.write(main)
+        f.write(payload)
+
+
+class FakeBuild:
+    """A build in the fake COPR, whose state follows from the time passed."""
+
+    def __init__(self, build_id, filename, chroots, queue_seconds, duration, fails):
+        self.id = build_id
+        self.filename = filename
+        self.chroots = list(chroots)
+        self.submitted = time.time()
+        self.started = self.submitted + queue_seconds
+        self.ended = self.started + duration
+        self.final_state = "failed" if fails else "succeeded"
+        # When the final state was first reported to the client
+        self.observed = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "chroots": self.chroots,
+            "submitted": self.submitted,
+            "started": self.started,
+            "ended": self.ended,
+            "final_state": self.final_state,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        build = cls(data["id"], data["filename"], data["chroots"], 0, 0, False)
+        build.submitted = data["submitted"]
+        build.started = data["started"]
+        build.ended = data["ended"]
+        build.final_state = data["final_state"]
+        return build
+
+    def snapshot(self):
+        """Return the build as the copr.v3 API would right now."""
+        now = time.time()
+        if now < self.started:
+            state, started_on, ended_on = "pending", None, None
+        elif now < self.ended:
+            state, started_on, ended_on = "running", int(self.started), None
+        else:
+            state, started_on = self.final_state, int(self.started)
+            ended_on = int(self.ended)
+            if self.observed is None:
+                self.observed = now
+        nvr = copr_bridge.CoprBridge._parse_srpm_nvr(self.filename)
+        return SimpleNamespace(
+            id=self.id,
+            state=state,
+            submitted_on=int(self.submitted),
+            started_on=started_on,
+            ended_on=ended_on,
+            chroots=self.chroots,
+            source_package={
+                "name": nvr[0] if nvr else None,
+                "version": "%s-%s" % nvr[1:] if nvr else None,
+            },
+        )
+
+
+class FakeClient:
+    """Stand-in for copr.v3.Client offering build_proxy and build_chroot_proxy.
+
+    Builds wait queue_seconds before running for duration seconds (or the
+    per-package duration in durations), then fail if their package is in
+    fail, if it is in flaky and was not built before, or with probability
+    failure_rate. Every API call takes latency seconds and fails with
+    probability api_error_rate, like an overloaded server (HTTP 503). The
+    first connection_errors submissions lose their connection instead. API
+    calls are counted per operation in calls.
+
+    With publish_socket, the end of each build is announced per chroot as
+    a JSON datagram to that unix socket, like COPR's build.end messages.
+    With builds_file, builds are loaded from and saved to that JSON file,
+    so that they outlive a restart of the bridge.
+    """
+
+    def __init__(
+        self,
+        duration=0,
+        durations=None,
+        queue_seconds=0,
+        failure_rate=0,
+        fail=(),
+        flaky=(),
+        latency=0,
+        api_error_rate=0,
+        connection_errors=0,
+        chroots=DEFAULT_CHROOTS,
+        publish_socket=None,
+        builds_file=None,
+        seed=None,
+    ):
+        self.duration = duration
+        self.durations = durations or {}
+        self.queue_seconds = queue_seconds
+        self.failure_rate = failure_rate
+        self.fail = set(fail)
+        self.flaky = set(flaky)
+        self.latency = latency
+        self.api_error_rate = api_error_rate
+        self.connection_errors = connection_errors
+        self.chroots = chroots
+        self.publish_socket = publish_socket
+        self.builds_file = builds_file
+        self.builds = {}
+        if builds_file and os.path.exists(builds_file):
+            with open(builds_file) as f:
+                for data in json.load(f):
+                    self.builds[data["id"]] = FakeBuild.from_dict(data)
+        self.calls = Counter()
+        self._ids = itertools.count(max(self.builds, default=0) + 1)
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.build_proxy = FakeBuildProxy(self)
+        self.build_chroot_proxy = FakeBuildChrootProxy(self)
+
+    def call(self, operation):
+        """Account for one API call: count it, wait, maybe raise an error."""
+        with self._lock:
+            self.calls[operation] += 1
+            error = self._random.random() < self.api_error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if error:
+            raise CoprRequestException(
+                "Injected error in fake COPR %s" % operation,
+                response=SimpleNamespace(status_code=503),
+            )
+
+    def submit(self, path, buildopts):
+        """Create a build of the SRPM at path (or URL), return its snapshot."""
+        with self._lock:
+            if self.connection_errors:
+                self.connection_errors -= 1
+                raise ConnectionResetError("Injected connection reset in fake COPR")
+        filename = os.path.basename(urllib.parse.urlsplit(path).path)
+        nvr = copr_bridge.CoprBridge._parse_srpm_nvr(filename)
+        name = nvr[0] if nvr else filename
+        with self._lock:
+            fails = name in self.fail or self._random.random() < self.failure_rate
+            if name in self.flaky:
+                fails = True
+                self.flaky.discard(name)
+            build = FakeBuild(
+                next(self._ids),
+                filename,
+                (buildopts or {}).get("chroots") or self.chroots,
+                self.queue_seconds,
+                self.durations.get(name, self.duration),
+                fails,
+            )
+            self.builds[build.id] = build
+        if self.publish_socket:
+            timer = threading.Timer(
+                max(0, build.ended - time.time()), self._publish, (build,)
+            )
+            timer.daemon = True
+            timer.start()
+        return build.snapshot()
+
+    def _publish(self, build):
+        """Announce the end of a build to publish_socket."""
+        snapshot = build.snapshot()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            for chroot in build.chroots:
+                body = {
+                    "build": build.id,
+                    "chroot": chroot,
+                    "status": 1 if snapshot.state == "succeeded" else 0,
+                    "pkg": snapshot.source_package["name"],
+                    "version": snapshot.source_package["version"],
+                    "what": "build end",
+                }
+                try:
+                    sock.sendto(
+                        json.dumps({"body": body}).encode(), self.publish_socket
+                    )
+                except OSError:
+                    pass
+
+    def get(self, build_id):
+        """Return the snapshot of a build, as build_proxy.get."""
+        with self._lock:
+            build = self.builds.get(build_id)
+        if build is None:
+            raise CoprNoResultException("Build %d does not exist" % build_id)
+        return build.snapshot()
+
+    def save(self):
+        """Write the builds to builds_file, if any."""
+        if self.builds_file:
+            with self._lock, open(self.builds_file, "w") as f:
+                json.dump([b.to_dict() for b in self.builds.values()], f)
+
+    def summary(self):
+        """Return a one-line summary of the builds and API calls so far."""
+        calls = ", ".join("%s=%d" % item for item in sorted(self.calls.items()))
+        return "Fake COPR: %d builds, API calls: %s" % (
+            len(self.builds),
+            calls or "none",
+        )
+
+
+class FakeBuildProxy:
+    """The build_proxy of FakeClient."""
+
+    def __init__(self, copr):
+        self.copr = copr
+
+    def create_from_file(self, ownername, projectname, path, buildopts=None):
+        self.copr.call("create_from_file")
+        return self.copr.submit(path, buildopts)
+
+    def create_from_url(self, ownername, projectname, url, buildopts=None):
+        self.copr.call("create_from_url")
+        return self.copr.submit(url, buildopts)
+
+    def get(self, build_id):
+        self.copr.call("get")
+        return self.copr.get(build_id)
+
+    def get_list(
+        self, ownername, projectname, packagename=None, status=None, pagination=None
+    ):
+        self.copr.call("get_list")
+        pagination = pagination or {}
+        with self.copr._lock:
+            build_ids = sorted(
+                self.copr.builds,
+                reverse=pagination.get("order_type", "ASC") == "DESC",
+            )
+        offset = pagination.get("offset", 0)
+        limit = pagination.get("limit")
+        if packagename is None and status is None:
+            build_ids = build_ids[offset : offset + limit if limit else None]
+            return [self.copr.get(build_id) for build_id in build_ids]
+
+        builds = [self.copr.get(build_id) for build_id in build_ids]
+        if packagename is not None:
+            builds = [b for b in builds if b.source_package["name"] == packagename]
+        if status is not None:
+            builds = [b for b in builds if b.state == status]
+        return builds[offset : offset + limit if limit else None]
+
+
+class FakeBuildChrootProxy:
+    """The build_chroot_proxy of FakeClient; all chroots share the build state."""
+
+    def __init__(self, copr):
+        self.copr = copr
+
+    def get_list(self, build_id, pagination=None):
+        self.copr.call("build_chroot_get_list")
+        build = self.copr.get(build_id)
+        return [SimpleNamespace(name=c, state=build.state) for c in build.chroots]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run copr_bridge.py against an in-process fake COPR",
+        usage="%(prog)s [options] -- [copr_bridge.py options]",
+    )
+    parser.add_argument(
+        "--duration",
+        default=0,
+        help="seconds each build runs (default: 0)",
+        type=float,
+    )
+    parser.add_argument(
+        "--package-duration",
+        action="append",
+        default=[],
+        help="NAME=SECONDS run time of one package's builds (repeatable)",
+    )
+    parser.add_argument(
+        "--queue-time",
+        default=0,
+        help="seconds each build waits for a builder (default: 0)",
+        type=float,
+    )
+    parser.add_argument(
+        "--failure-rate",
+        default=0,
+        help="probability that a build fails (default: 0)",
+        type=float,
+    )
+    parser.add_argument(
+        "--fail",
+        action="append",
+        default=[],
+        help="package name whose builds fail (repeatable)",
+    )
+    parser.add_argument(
+        "--flaky",
+        action="append",
+        default=[],
+        help="package name whose first build fails (repeatable)",
+    )
+    parser.add_argument(
+        "--latency",
+        default=0,
+        help="seconds each API call takes (default: 0)",
+        type=float,
+    )
+    parser.add_argument(
+        "--api-error-rate",
+        default=0,
+        help="probability that an API call fails with HTTP 503 (default: 0)",
+        type=float,
+    )
+    parser.add_argument(
+        "--connection-errors",
+        default=0,
+        help="number of initial submissions failing with a connection reset "
+        "(default: 0)",
+        type=int,
+    )
+    parser.add_argument(
+        "--publish-socket",
+        help="announce build ends as JSON datagrams to this unix socket, "
+        "for copr_bridge.py --notify unix:PATH (default: disabled)",
+        type=str,
+    )
+    parser.add_argument(
+        "--builds-file",
+        help="keep the fake COPR's builds in this JSON file across runs "
+        "(default: in memory only)",
+        type=str,
+    )
+    parser.add_argument(
+        "--seed",
+        help="random seed for failures and API errors (default: random)",
+        type=int,
+    )
+
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+
+    durations = {}
+    for item in args.package_duration:
+        name, _, seconds = item.partition("=")
+        try:
+            durations[name] = float(seconds)
+        except ValueError:
+            parser.error("--package-duration expects NAME=SECONDS, got '%s'" % item)
+
+    client = FakeClient(
+        duration=args.duration,
+        durations=durations,
+        queue_seconds=args.queue_time,
+        failure_rate=args.failure_rate,
+        fail=args.fail,
+        flaky=args.flaky,
+        latency=args.latency,
+        api_error_rate=args.api_error_rate,
+        connection_errors=args.connection_errors,
+        publish_socket=args.publish_socket,
+        builds_file=args.builds_file,
+        seed=args.seed,
+    )
+    copr_bridge.create_client = lambda _args: client
+    sys.argv = [copr_bridge.__file__] + argv[split + 1 :]
+    try:
+        copr_bridge.main()
+    finally:
+        client.save()
+        print(client.summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
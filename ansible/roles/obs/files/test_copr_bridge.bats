@@ -2,8 +2,51 @@
 # shellcheck disable=SC2086,SC2154
 
 SCRIPT="ansible/roles/obs/files/copr_bridge.py"
+FAKE_COPR="ansible/roles/obs/files/fake_copr.py"
 COMMON_ARGS="--copr-project test/project --chroot rhel+epel-10-ppc64le"
 
+# Write a minimal SRPM (lead and headers, no payload) with the given
+# BuildRequires: make_srpm <path> <name> <[epoch:]version> <release> [requires...]
+make_srpm() {
+	python3 - "$@" <<-'EOF'
+		import struct
+		import sys
+
+		path, name, version, release = sys.argv[1:5]
+		epoch, _, version = version.rpartition(":")
+		requires = sys.argv[5:]
+
+		def header(tags):
+		    index, store = b"", b""
+		    for tag, values in tags:
+		        if isinstance(values, int):
+		            store += b"\0" * (-len(store) % 4)
+		            index += struct.pack(">iiii", tag, 4, len(store), 1)
+		            store += struct.pack(">i", values)
+		            continue
+		        tag_type = 6 if len(values) == 1 and tag < 1003 else 8
+		        index += struct.pack(">iiii", tag, tag_type, len(store), len(values))
+		        store += b"".join(v.encode() + b"\0" for v in values)
+		    intro = b"\x8e\xad\xe8\x01\0\0\0\0" + struct.pack(">ii", len(tags), len(store))
+		    return intro + index + store
+
+		tags = [(1000, [name]), (1001, [version]), (1002, [release])]
+		if epoch:
+		    tags.append((1003, int(epoch)))
+		if requires:
+		    tags.append((1049, requires))
+		with open(path, "wb") as f:
+		    f.write(b"\xed\xab\xee\xdb\x03\x00\x00\x01" + b"\0" * 88)
+		    f.write(header([]))
+		    f.write(header(tags))
+	EOF
+}
+
+# Print the number of fake COPR API calls of an operation in $output
+fake_calls() {
+	echo "${output}" | grep -o " ${1}=[0-9]*" | cut -d= -f2
+}
+
 setup() {
 	TEST_DIR=$(mktemp -d)
 	STATE_FILE="${TEST_DIR}/state.json"
@@ -350,6 +393,40 @@ print('broken-ohpc-1.0-1.src.rpm' not in s['builds'])
 	[[ "$output" == *"not failed/canceled"* ]]
 }
 
+@test "reset-failed accepts invalid SRPMs" {
+	cat >"${STATE_FILE}" <<-'EOF'
+		{
+		  "version": 1,
+		  "srpm_dir": "/tmp",
+		  "copr_project": "test/project",
+		  "chroot": "rhel+epel-10-ppc64le",
+		  "builds": {
+		    "bad-ohpc-1.0-1.src.rpm": {
+		      "status": "invalid",
+		      "reason": "payload digest mismatch",
+		      "mtime": 1000000,
+		      "size": 4096
+		    }
+		  },
+		  "last_succeeded": null,
+		  "blocked_on": null
+		}
+	EOF
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--state-file "${STATE_FILE}" \
+		--reset-failed "bad-ohpc-1.0-1.src.rpm"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Removed 'bad-ohpc-1.0-1.src.rpm' (was 'invalid')"* ]]
+	python3 -c "
+import json
+assert 'bad-ohpc-1.0-1.src.rpm' not in json.load(open('${STATE_FILE}'))['builds']
+"
+}
+
 @test "reset-failed rejects unknown SRPM" {
 	# Create empty state
 	cat >"${STATE_FILE}" <<-'EOF'
@@ -566,3 +643,1173 @@ print('broken-ohpc-1.0-1.src.rpm' not in s['builds'])
 	submitted=$(echo "$output" | grep -c '\[dry-run\]')
 	[ "$submitted" -eq 2 ]
 }
+
+@test "max-inflight flag is accepted and documented" {
+	run python3 "${SCRIPT}" --help
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"--max-inflight"* ]]
+	[[ "$output" == *"builds in flight at once"* ]]
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--max-inflight 4 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	submitted=$(echo "$output" | grep -c '\[dry-run\]')
+	[ "$submitted" -eq 6 ]
+}
+
+@test "max-inflight below one is rejected" {
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--max-inflight 0 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -ne 0 ]
+	[[ "$output" == *"--max-inflight must be at least 1"* ]]
+}
+
+@test "dry-run scan orders SRPMs by BuildRequires before mtime" {
+	dep_dir=$(mktemp -d)
+	make_srpm "${dep_dir}/app-ohpc-1.0-1.src.rpm" app-ohpc 1.0 1 \
+		lib-ohpc-devel rpmlib\(CompressedFileNames\)
+	make_srpm "${dep_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	make_srpm "${dep_dir}/tool-ohpc-1.0-1.src.rpm" tool-ohpc 1.0 1
+	touch -t 202506260000 "${dep_dir}/app-ohpc-1.0-1.src.rpm"
+	touch -t 202506261500 "${dep_dir}/tool-ohpc-1.0-1.src.rpm"
+	touch -t 202506270900 "${dep_dir}/lib-ohpc-2.0-1.src.rpm"
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${dep_dir}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--state-file "${STATE_FILE}"
+	rm -rf "${dep_dir}"
+	[ "$status" -eq 0 ]
+
+	order=$(echo "$output" | grep '\[dry-run\]' | sed 's/.*Would submit //' | sed 's/ to .*//')
+	# app-ohpc is oldest but needs lib-ohpc, so tool-ohpc goes first
+	[ "$(echo "$order" | sed -n 1p)" = "tool-ohpc-1.0-1.src.rpm" ]
+	[ "$(echo "$order" | sed -n 2p)" = "lib-ohpc-2.0-1.src.rpm" ]
+	[ "$(echo "$order" | sed -n 3p)" = "app-ohpc-1.0-1.src.rpm" ]
+}
+
+@test "longest-first schedule starts the longest chain of builds first" {
+	dep_dir=$(mktemp -d)
+	make_srpm "${dep_dir}/short-ohpc-1.0-1.src.rpm" short-ohpc 1.0 1
+	make_srpm "${dep_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	make_srpm "${dep_dir}/app-ohpc-1.0-1.src.rpm" app-ohpc 1.0 1 lib-ohpc
+	make_srpm "${dep_dir}/long-ohpc-1.0-1.src.rpm" long-ohpc 1.0 1
+	touch -t 202506260000 "${dep_dir}/short-ohpc-1.0-1.src.rpm"
+	touch -t 202506261500 "${dep_dir}/lib-ohpc-2.0-1.src.rpm"
+	touch -t 202506270900 "${dep_dir}/app-ohpc-1.0-1.src.rpm"
+	touch -t 202506271600 "${dep_dir}/long-ohpc-1.0-1.src.rpm"
+	python3 - "${STATE_FILE}" <<-'EOF'
+		import json
+		import sys
+
+		durations = {"short-ohpc": 60, "lib-ohpc": 120, "app-ohpc": 3000, "long-ohpc": 3600}
+		builds = {
+		    "%s-0.9-1.src.rpm" % name: {
+		        "status": "succeeded",
+		        "copr_build_id": 1000 + i,
+		        "mtime": 1000000,
+		        "build_seconds": seconds,
+		    }
+		    for i, (name, seconds) in enumerate(durations.items())
+		}
+		state = {
+		    "version": 1,
+		    "srpm_dir": "/tmp",
+		    "copr_project": "test/project",
+		    "chroot": "rhel+epel-10-ppc64le",
+		    "builds": builds,
+		    "last_succeeded": None,
+		    "blocked_on": None,
+		}
+		with open(sys.argv[1], "w") as f:
+		    json.dump(state, f)
+	EOF
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${dep_dir}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--schedule longest-first \
+		--state-file "${STATE_FILE}"
+	rm -rf "${dep_dir}"
+	[ "$status" -eq 0 ]
+
+	order=$(echo "$output" | grep '\[dry-run\]' | sed 's/.*Would submit //' | sed 's/ to .*//')
+	# lib-ohpc alone is short, but app-ohpc waits on it: 3120s vs 3600s
+	[ "$(echo "$order" | sed -n 1p)" = "long-ohpc-1.0-1.src.rpm" ]
+	[ "$(echo "$order" | sed -n 2p)" = "lib-ohpc-2.0-1.src.rpm" ]
+	[ "$(echo "$order" | sed -n 3p)" = "app-ohpc-1.0-1.src.rpm" ]
+	[ "$(echo "$order" | sed -n 4p)" = "short-ohpc-1.0-1.src.rpm" ]
+}
+
+@test "builds against the fake COPR are submitted and polled to completion" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	make_srpm "${fake_dir}/app-ohpc-1.0-1.src.rpm" app-ohpc 1.0 1 lib-ohpc
+	make_srpm "${fake_dir}/tool-ohpc-1.0-1.src.rpm" tool-ohpc 1.0 1
+
+	run python3 "${FAKE_COPR}" --duration 0.5 -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--max-inflight 2 \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Scan complete: 3 succeeded, 0 skipped, 0 failed"* ]]
+	[[ "$output" == *"Fake COPR: 3 builds, API calls: create_from_file=3"* ]]
+	python3 -c "
+import json
+builds = json.load(open('${STATE_FILE}'))['builds']
+assert all(b['status'] == 'succeeded' for b in builds.values()), builds
+assert all(b['copr_build_id'] > 0 for b in builds.values()), builds
+"
+}
+
+@test "in-flight builds are polled with one list call per cycle" {
+	fake_dir=$(mktemp -d)
+	for name in one two three four; do
+		make_srpm "${fake_dir}/${name}-ohpc-1.0-1.src.rpm" "${name}-ohpc" 1.0 1
+	done
+
+	run python3 "${FAKE_COPR}" --duration 3 -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--max-inflight 4 \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Scan complete: 4 succeeded, 0 skipped, 0 failed"* ]]
+	# No build is fetched on its own; one history call plus about one
+	# list call per second, where per-build polling would need 4 each
+	[ -z "$(fake_calls get)" ]
+	[ "$(fake_calls get_list)" -le 8 ]
+}
+
+@test "running builds with a known duration are polled sparsely" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	cat >"${STATE_FILE}" <<-'EOF'
+		{
+		  "version": 1,
+		  "builds": {},
+		  "durations": {"lib-ohpc": [10]},
+		  "last_succeeded": null,
+		  "blocked_on": null
+		}
+	EOF
+
+	run python3 "${FAKE_COPR}" --duration 10 -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Build succeeded: lib-ohpc-2.0-1.src.rpm"* ]]
+	# Halving the expected remaining time skips early polls: one history
+	# call and about 6 polls instead of 11 at the poll interval
+	[ "$(fake_calls get_list)" -le 8 ]
+}
+
+@test "failed build in the fake COPR blocks the scan" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	make_srpm "${fake_dir}/tool-ohpc-1.0-1.src.rpm" tool-ohpc 1.0 1
+	touch -t 202506260000 "${fake_dir}/lib-ohpc-2.0-1.src.rpm"
+
+	run python3 "${FAKE_COPR}" --fail lib-ohpc -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[[ "$output" == *"Build failed for lib-ohpc-2.0-1.src.rpm"* ]]
+	[[ "$output" == *"Fake COPR: 1 builds"* ]]
+	python3 -c "
+import json
+s = json.load(open('${STATE_FILE}'))
+assert s['blocked_on'] == 'lib-ohpc-2.0-1.src.rpm', s['blocked_on']
+assert 'tool-ohpc-1.0-1.src.rpm' not in s['builds']
+"
+}
+
+@test "max-attempts retries failed builds without blocking the others" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	make_srpm "${fake_dir}/app-ohpc-1.0-1.src.rpm" app-ohpc 1.0 1 lib-ohpc
+	make_srpm "${fake_dir}/flaky-ohpc-1.0-1.src.rpm" flaky-ohpc 1.0 1
+	make_srpm "${fake_dir}/tool-ohpc-1.0-1.src.rpm" tool-ohpc 1.0 1
+	touch -t 202506260000 "${fake_dir}/lib-ohpc-2.0-1.src.rpm"
+	touch -t 202506261500 "${fake_dir}/flaky-ohpc-1.0-1.src.rpm"
+
+	run python3 "${FAKE_COPR}" --fail lib-ohpc --flaky flaky-ohpc -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--max-attempts 2 \
+		--retry-backoff 1 \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Retrying lib-ohpc-2.0-1.src.rpm in 1s (attempt 1 of 2 failed)"* ]]
+	[[ "$output" == *"Retrying flaky-ohpc-1.0-1.src.rpm in 1s"* ]]
+	[[ "$output" == *"lib-ohpc-2.0-1.src.rpm failed permanently after 2 attempt(s)"* ]]
+	[[ "$output" == *"Not submitting app-ohpc-1.0-1.src.rpm: BuildRequires provider lib-ohpc-2.0-1.src.rpm failed"* ]]
+	[[ "$output" == *"Fake COPR: 5 builds"* ]]
+	python3 -c "
+import json
+s = json.load(open('${STATE_FILE}'))
+builds = s['builds']
+assert s['blocked_on'] is None, s['blocked_on']
+assert builds['lib-ohpc-2.0-1.src.rpm']['status'] == 'permanently-failed'
+assert builds['flaky-ohpc-1.0-1.src.rpm']['status'] == 'succeeded'
+assert builds['flaky-ohpc-1.0-1.src.rpm']['attempts'] == 2
+assert builds['tool-ohpc-1.0-1.src.rpm']['status'] == 'succeeded'
+assert 'app-ohpc-1.0-1.src.rpm' not in builds
+"
+}
+
+@test "shutdown requests interrupt the wait for a retry" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+
+	# Without an interruptible wait, TERM only takes effect after 60s and
+	# KILL ends the process first
+	started=${SECONDS}
+	run timeout -s TERM -k 5 3 python3 "${FAKE_COPR}" --fail lib-ohpc -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--max-attempts 3 \
+		--retry-backoff 60 \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 124 ]
+	[ $((SECONDS - started)) -lt 8 ]
+	[[ "$output" == *"Retrying lib-ohpc-2.0-1.src.rpm in 60s (attempt 1 of 3 failed)"* ]]
+	[[ "$output" == *"Received SIGTERM, shutting down gracefully"* ]]
+}
+
+@test "connection errors during upload are retried" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+
+	run python3 "${FAKE_COPR}" --connection-errors 1 -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--max-attempts 2 \
+		--retry-backoff 1 \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Injected connection reset"* ]]
+	[[ "$output" == *"Retrying lib-ohpc-2.0-1.src.rpm in 1s (attempt 1 of 2 failed)"* ]]
+	[[ "$output" == *"Scan complete: 1 succeeded, 0 skipped, 0 failed"* ]]
+}
+
+@test "builds in flight at shutdown are re-attached on restart" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	make_srpm "${fake_dir}/tool-ohpc-1.0-1.src.rpm" tool-ohpc 1.0 1
+	touch -t 202506260000 "${fake_dir}/lib-ohpc-2.0-1.src.rpm"
+
+	run timeout -s TERM 1.5 python3 "${FAKE_COPR}" --duration 3 \
+		--builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--max-inflight 2 \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	[[ "$output" == *"Leaving 2 build(s) in flight"* ]]
+	# Lose the build of tool-ohpc, as if it was deleted from COPR
+	python3 -c "
+import json
+s = json.load(open('${STATE_FILE}'))
+assert all(b['status'] == 'pending' for b in s['builds'].values()), s['builds']
+s['builds']['tool-ohpc-1.0-1.src.rpm']['copr_build_id'] = 999
+json.dump(s, open('${STATE_FILE}', 'w'))
+"
+
+	run python3 "${FAKE_COPR}" --duration 3 \
+		--builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--max-inflight 2 \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Re-attaching to build 1 of lib-ohpc-2.0-1.src.rpm"* ]]
+	[[ "$output" == *"Resubmitting tool-ohpc-1.0-1.src.rpm"* ]]
+	[[ "$output" == *"Scan complete: 2 succeeded, 0 skipped, 0 failed"* ]]
+	# Only the lost build was submitted again
+	[[ "$output" == *"API calls: create_from_file=1,"* ]]
+	python3 -c "
+import json
+builds = json.load(open('${STATE_FILE}'))['builds']
+assert builds['lib-ohpc-2.0-1.src.rpm']['copr_build_id'] == 1, builds
+assert builds['tool-ohpc-1.0-1.src.rpm']['copr_build_id'] == 3, builds
+assert all(b['status'] == 'succeeded' for b in builds.values()), builds
+"
+}
+
+@test "incomplete and corrupt SRPMs are held back before submission" {
+	fake_dir=$(mktemp -d)
+	python3 - "${fake_dir}" <<-'EOF'
+		import sys
+
+		sys.path.insert(0, "ansible/roles/obs/files")
+		from fake_copr import write_srpm
+
+		fake_dir = sys.argv[1]
+		for name in ("good-ohpc", "partial-ohpc", "corrupt-ohpc"):
+		    write_srpm("%s/%s-1.0-1.src.rpm" % (fake_dir, name), name, "1.0", "1", size=4096)
+		with open(fake_dir + "/partial-ohpc-1.0-1.src.rpm", "r+b") as f:
+		    f.truncate(f.seek(0, 2) - 1000)
+		with open(fake_dir + "/corrupt-ohpc-1.0-1.src.rpm", "r+b") as f:
+		    f.seek(-1, 2)
+		    f.write(b"x")
+	EOF
+
+	run python3 "${FAKE_COPR}" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Deferring partial-ohpc-1.0-1.src.rpm until it is written completely"* ]]
+	[[ "$output" == *"Not submitting invalid SRPM corrupt-ohpc-1.0-1.src.rpm: payload digest mismatch"* ]]
+	[[ "$output" == *"Scan complete: 1 succeeded, 0 skipped, 1 failed"* ]]
+	[[ "$output" == *"API calls: create_from_file=1,"* ]]
+
+	# Once complete, the deferred SRPM is submitted; the corrupt one is not
+	python3 -c "
+import sys
+sys.path.insert(0, 'ansible/roles/obs/files')
+from fake_copr import write_srpm
+write_srpm('${fake_dir}/partial-ohpc-1.0-1.src.rpm', 'partial-ohpc', '1.0', '1', size=4096)
+"
+	run python3 "${FAKE_COPR}" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Build succeeded: partial-ohpc-1.0-1.src.rpm"* ]]
+	[[ "$output" == *"API calls: create_from_file=1,"* ]]
+	python3 -c "
+import json
+builds = json.load(open('${STATE_FILE}'))['builds']
+assert builds['corrupt-ohpc-1.0-1.src.rpm']['status'] == 'invalid', builds
+assert builds['partial-ohpc-1.0-1.src.rpm']['status'] == 'succeeded', builds
+"
+
+	# Fixed in place (same inode), the corrupt SRPM is validated again
+	python3 -c "
+import sys
+sys.path.insert(0, 'ansible/roles/obs/files')
+from fake_copr import write_srpm
+write_srpm('${fake_dir}/fixed.rpm', 'corrupt-ohpc', '1.0', '1', size=4096)
+with open('${fake_dir}/corrupt-ohpc-1.0-1.src.rpm', 'r+b') as f:
+    f.write(open('${fake_dir}/fixed.rpm', 'rb').read())
+"
+	rm "${fake_dir}/fixed.rpm"
+	run python3 "${FAKE_COPR}" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Build succeeded: corrupt-ohpc-1.0-1.src.rpm"* ]]
+}
+
+@test "notified builds are polled without waiting for the poll interval" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	make_srpm "${fake_dir}/tool-ohpc-1.0-1.src.rpm" tool-ohpc 1.0 1
+
+	started=${SECONDS}
+	run python3 "${FAKE_COPR}" --duration 1 \
+		--publish-socket "${TEST_DIR}/notify.sock" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 60 \
+		--notify "unix:${TEST_DIR}/notify.sock" \
+		--debug \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Notified of build(s) 1, polling"* ]]
+	[[ "$output" == *"Scan complete: 2 succeeded, 0 skipped, 0 failed"* ]]
+	# Without notifications each build would wait for a 10s poll
+	[ $((SECONDS - started)) -lt 10 ]
+	[ ! -e "${TEST_DIR}/notify.sock" ]
+}
+
+@test "notify paths that are not sockets are left alone" {
+	echo precious >"${TEST_DIR}/notes.txt"
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--notify "unix:${TEST_DIR}/notes.txt" \
+		--state-file "${STATE_FILE}"
+	[ "$status" -ne 0 ]
+	[[ "$output" == *"notes.txt exists and is not a socket"* ]]
+	[ "$(cat "${TEST_DIR}/notes.txt")" = "precious" ]
+}
+
+@test "unsupported notify backend is rejected" {
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--notify "amqp://localhost" \
+		--state-file "${STATE_FILE}"
+	[ "$status" -ne 0 ]
+	[[ "$output" == *"Unsupported --notify value"* ]]
+}
+
+@test "API rate limits back off when COPR is overloaded" {
+	fake_dir=$(mktemp -d)
+	for name in a b c; do
+		make_srpm "${fake_dir}/${name}-ohpc-1.0-1.src.rpm" "${name}-ohpc" 1.0 1
+	done
+
+	started=${SECONDS}
+	run python3 "${FAKE_COPR}" --api-error-rate 1 -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--ignore-errors \
+		--api-rate submit=4 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"COPR API overloaded, slowing submit requests to 2.00/s"* ]]
+	[[ "$output" == *"COPR API overloaded, slowing submit requests to 1.00/s"* ]]
+	[[ "$output" == *"COPR API overloaded, slowing history requests to 5.00/s"* ]]
+	# The second and third submission wait 0.5s and 1s for a token
+	[ $((SECONDS - started)) -ge 1 ]
+
+	run python3 "${SCRIPT}" --srpm-dir "${TEST_DIR}" ${COMMON_ARGS} --api-rate upload=1
+	[ "$status" -ne 0 ]
+	[[ "$output" == *"expected BUDGET=RATE"* ]]
+}
+
+@test "state journal is replayed on start and compacted on exit" {
+	# A journal left behind by an interrupted run, ending in a torn record
+	cat >"${STATE_FILE}.journal" <<-'EOF'
+		{"build":"ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm","entry":{"status":"skipped","reason":"already-in-copr","mtime":1000000}}
+		{"key":"last_succeeded","value":"ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm"}
+		{"build":"docs-ohpc-4.1.0-420.oh
+	EOF
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Ignoring corrupt state journal record"* ]]
+
+	# The journaled already-in-copr entry is honoured
+	submitted=$(echo "$output" | grep -c '\[dry-run\]')
+	[ "$submitted" -eq 5 ]
+
+	# Everything is folded into the state file and the journal is gone
+	[ ! -e "${STATE_FILE}.journal" ]
+	last=$(python3 -c "import json; print(json.load(open('${STATE_FILE}'))['last_succeeded'])")
+	[ "$last" = "ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm" ]
+	count=$(python3 -c "import json; print(len(json.load(open('${STATE_FILE}'))['builds']))")
+	[ "$count" -eq 6 ]
+}
+
+@test "state journal records after a torn record survive the next crash" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+	printf '{"build":"docs-ohpc-4.1.0-420.oh' >"${STATE_FILE}.journal"
+
+	# Crash while the build is in flight, leaving the journal behind
+	run timeout -s KILL 1.5 python3 "${FAKE_COPR}" --duration 3 -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[[ "$output" == *"Dropping torn state journal record"* ]]
+	python3 -c "
+import json
+records = [json.loads(line) for line in open('${STATE_FILE}.journal')]
+pending = [r['entry'] for r in records if r.get('build') == 'lib-ohpc-2.0-1.src.rpm']
+assert pending and pending[-1]['status'] == 'pending', records
+assert pending[-1]['copr_build_id'] == 1, records
+"
+}
+
+@test "history-refresh flag is accepted and documented" {
+	run python3 "${SCRIPT}" --help
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"--history-refresh"* ]]
+	[[ "$output" == *"refreshes of the cached COPR build"* ]]
+}
+
+@test "COPR history is fetched incrementally above the high-water mark" {
+	fake_dir=$(mktemp -d)
+	# 1200 finished builds take several history pages to walk
+	python3 - "${TEST_DIR}/builds.json" <<-'EOF'
+		import json
+		import sys
+		import time
+
+		ended = time.time() - 3600
+		builds = [
+		    {
+		        "id": build_id,
+		        "filename": "pkg%d-ohpc-1.0-1.src.rpm" % build_id,
+		        "chroots": ["rhel+epel-10-ppc64le"],
+		        "submitted": ended,
+		        "started": ended,
+		        "ended": ended,
+		        "final_state": "succeeded",
+		    }
+		    for build_id in range(1, 1201)
+		]
+		json.dump(builds, open(sys.argv[1], "w"))
+	EOF
+
+	run python3 "${FAKE_COPR}" --builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Found 1200 unique successful builds in COPR"* ]]
+	[ "$(fake_calls get_list)" -gt 1 ]
+
+	run python3 "${FAKE_COPR}" --builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Checking builds newer than 1200"* ]]
+	[[ "$output" == *"Found 1200 unique successful builds in COPR"* ]]
+	[ "$(fake_calls get_list)" -eq 1 ]
+}
+
+@test "retention-days archives old entries and keeps them processed" {
+	cat >"${STATE_FILE}" <<-'EOF'
+		{
+		  "version": 1,
+		  "srpm_dir": "/tmp",
+		  "copr_project": "test/project",
+		  "chroot": "rhel+epel-10-ppc64le",
+		  "builds": {
+		    "ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm": {
+		      "status": "succeeded",
+		      "copr_build_id": 1001,
+		      "submitted_at": "2020-01-01T00:00:00",
+		      "completed_at": "2020-01-01T01:00:00",
+		      "mtime": 1000000,
+		      "build_seconds": 3600
+		    },
+		    "gone-ohpc-1.0-1.src.rpm": {
+		      "status": "succeeded",
+		      "copr_build_id": 1000,
+		      "completed_at": "2020-01-01T00:00:00",
+		      "mtime": 1000000
+		    }
+		  },
+		  "last_succeeded": null,
+		  "blocked_on": null
+		}
+	EOF
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--retention-days 30 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Would submit docs-ohpc"* ]]
+	[[ "$output" != *"Would submit ohpc-filesystem"* ]]
+
+	# Archived SRPMs still count as processed on the next run
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--retention-days 30 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Would submit docs-ohpc"* ]]
+	[[ "$output" != *"Would submit ohpc-filesystem"* ]]
+
+	python3 - "${STATE_FILE}" <<-'EOF'
+		import glob
+		import gzip
+		import json
+		import sys
+
+		state = json.load(open(sys.argv[1]))
+		assert "ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm" not in state["builds"]
+		assert state["archived"] == {"ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm": "succeeded"}
+		assert state["durations"] == {"ohpc-filesystem": [3600]}
+		archived = {}
+		for segment in glob.glob(sys.argv[1] + ".archive/*.jsonl.gz"):
+		    for line in gzip.open(segment, "rt"):
+		        record = json.loads(line)
+		        archived[record["build"]] = record["entry"]
+		assert archived["gone-ohpc-1.0-1.src.rpm"]["copr_build_id"] == 1000
+		assert archived["ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm"]["copr_build_id"] == 1001
+	EOF
+}
+
+@test "retention-releases archives all but the newest releases" {
+	python3 - "${STATE_FILE}" <<-'EOF'
+		import json
+		import sys
+
+		builds = {
+		    "pkg-ohpc-1.%d-1.src.rpm" % minor: {"status": "succeeded", "mtime": 1000000}
+		    for minor in (2, 9, 10)
+		}
+		state = {
+		    "version": 1,
+		    "srpm_dir": "/tmp",
+		    "copr_project": "test/project",
+		    "chroot": "rhel+epel-10-ppc64le",
+		    "builds": builds,
+		    "last_succeeded": None,
+		    "blocked_on": None,
+		}
+		json.dump(state, open(sys.argv[1], "w"))
+	EOF
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--retention-releases 2 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Archived 1 state entries"* ]]
+	python3 -c "
+import json
+builds = json.load(open('${STATE_FILE}'))['builds']
+assert 'pkg-ohpc-1.2-1.src.rpm' not in builds
+assert 'pkg-ohpc-1.9-1.src.rpm' in builds and 'pkg-ohpc-1.10-1.src.rpm' in builds
+"
+}
+
+@test "older SRPMs of the same package are superseded" {
+	touch -t 202506250000 "${TEST_DIR}/hwloc-ohpc-2.14.0-420.ohpc.2.2.src.rpm"
+	touch -t 202506290000 "${TEST_DIR}/hwloc-ohpc-2.9.0-420.ohpc.1.1.src.rpm"
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Would submit hwloc-ohpc-2.14.0-420.ohpc.2.2.src.rpm"* ]]
+	[[ "$output" != *"Would submit hwloc-ohpc-2.14.0-420.ohpc.2.1.src.rpm"* ]]
+	[[ "$output" != *"Would submit hwloc-ohpc-2.9.0-420.ohpc.1.1.src.rpm"* ]]
+
+	python3 -c "
+import json
+builds = json.load(open('${STATE_FILE}'))['builds']
+for old in ('hwloc-ohpc-2.14.0-420.ohpc.2.1.src.rpm', 'hwloc-ohpc-2.9.0-420.ohpc.1.1.src.rpm'):
+    assert builds[old]['reason'] == 'superseded', builds[old]
+    assert builds[old]['superseded_by'] == 'hwloc-ohpc-2.14.0-420.ohpc.2.2.src.rpm'
+"
+}
+
+@test "SRPMs older than one already built in COPR are superseded" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/hwloc-ohpc-2.2-1.src.rpm" hwloc-ohpc 2.2 1
+	run python3 "${FAKE_COPR}" --builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+
+	# Without state, 2.2 is only known to be built from the COPR history
+	rm -f "${STATE_FILE}"*
+	make_srpm "${fake_dir}/hwloc-ohpc-2.1-1.src.rpm" hwloc-ohpc 2.1 1
+	touch -t 202506250000 "${fake_dir}/hwloc-ohpc-2.1-1.src.rpm"
+	run python3 "${FAKE_COPR}" --builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Skipping hwloc-ohpc-2.1-1.src.rpm (superseded by hwloc-ohpc-2.2-1.src.rpm)"* ]]
+	[[ "$output" != *"create_from_file"* ]]
+}
+
+@test "the epoch takes precedence over the version when superseding" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/pkg-ohpc-1.0-1.src.rpm" pkg-ohpc 1:1.0 1
+	make_srpm "${fake_dir}/pkg-ohpc-2.0-1.src.rpm" pkg-ohpc 2.0 1
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Would submit pkg-ohpc-1.0-1.src.rpm"* ]]
+	[[ "$output" == *"Skipping pkg-ohpc-2.0-1.src.rpm (superseded by pkg-ohpc-1.0-1.src.rpm)"* ]]
+}
+
+@test "watch mode queues SRPMs arriving after the initial scan" {
+	python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--mode watch \
+		--state-file "${STATE_FILE}" >"${TEST_DIR}/watch.log" 2>&1 &
+	pid=$!
+	for _ in $(seq 50); do
+		grep -q "Watching" "${TEST_DIR}/watch.log" && break
+		sleep 0.1
+	done
+	touch "${TEST_DIR}/late-ohpc-1.0-1.src.rpm"
+	touch "${TEST_DIR}/late-ohpc-1.0-1.x86_64.rpm"
+	for _ in $(seq 50); do
+		grep -q "Would submit late-ohpc" "${TEST_DIR}/watch.log" && break
+		sleep 0.1
+	done
+	kill -TERM "${pid}"
+	wait "${pid}"
+
+	grep -q "Would submit ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm" "${TEST_DIR}/watch.log"
+	grep -q "New SRPM detected: late-ohpc-1.0-1.src.rpm" "${TEST_DIR}/watch.log"
+	grep -q "Would submit late-ohpc-1.0-1.src.rpm" "${TEST_DIR}/watch.log"
+	run grep -c "late-ohpc-1.0-1.x86_64.rpm" "${TEST_DIR}/watch.log"
+	[ "$output" = "0" ]
+}
+
+@test "directory index is persisted and rescans detect changed SRPMs" {
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--debug \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"6 SRPMs are new or changed since the last scan"* ]]
+
+	python3 -c "
+import json
+entries = json.load(open('${STATE_FILE}.dir-index'))['entries']
+assert len(entries) == 6, entries
+assert 'hwloc-ohpc-2.14.0-420.ohpc.2.1.aarch64.rpm' not in entries
+"
+
+	touch "${TEST_DIR}/late-ohpc-1.0-1.src.rpm"
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--debug \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"1 SRPMs are new or changed since the last scan"* ]]
+	[[ "$output" == *"Would submit late-ohpc-1.0-1.src.rpm"* ]]
+
+	# Rewriting in place keeps the inode, but not the size and mtime
+	inode=$(stat -c %i "${TEST_DIR}/late-ohpc-1.0-1.src.rpm")
+	echo rebuilt >"${TEST_DIR}/late-ohpc-1.0-1.src.rpm"
+	[ "$(stat -c %i "${TEST_DIR}/late-ohpc-1.0-1.src.rpm")" = "${inode}" ]
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--debug \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"1 SRPMs are new or changed since the last scan"* ]]
+	python3 -c "
+import json
+entries = json.load(open('${STATE_FILE}.dir-index'))['entries']
+assert entries['late-ohpc-1.0-1.src.rpm'][1] == 8, entries
+"
+}
+
+@test "SRPMs with content already built in the chroot are not submitted" {
+	# The fixtures are empty files; record their SHA-256 as built
+	empty_sha256=$(sha256sum </dev/null | cut -d' ' -f1)
+	cat >"${STATE_FILE}" <<-EOF
+		{
+		  "version": 1,
+		  "srpm_dir": "/tmp",
+		  "copr_project": "test/project",
+		  "chroot": "rhel+epel-10-ppc64le",
+		  "builds": {
+		    "old-ohpc-1.0-1.src.rpm": {
+		      "status": "succeeded",
+		      "copr_build_id": 99999,
+		      "mtime": 1000000,
+		      "sha256": "${empty_sha256}",
+		      "chroot": "rhel+epel-10-ppc64le"
+		    }
+		  },
+		  "last_succeeded": "old-ohpc-1.0-1.src.rpm",
+		  "blocked_on": null
+		}
+	EOF
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Skipping ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm (identical content already built as old-ohpc-1.0-1.src.rpm)"* ]]
+	[[ "$output" != *"Would submit"* ]]
+
+	# The same content built for another chroot does not count
+	python3 -c "
+import json
+state = json.load(open('${STATE_FILE}'))
+old = state['builds']['old-ohpc-1.0-1.src.rpm']
+old['chroot'] = 'fedora-rawhide-ppc64le'
+state['builds'] = {'old-ohpc-1.0-1.src.rpm': old}
+json.dump(state, open('${STATE_FILE}', 'w'))
+"
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Would submit ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm"* ]]
+}
+
+@test "srpm-base-url submits published SRPMs by URL" {
+	port=$(python3 -c "
+import socket
+s = socket.socket()
+s.bind(('127.0.0.1', 0))
+print(s.getsockname()[1])
+")
+	python3 -m http.server --bind 127.0.0.1 --directory "${TEST_DIR}" "${port}" \
+		>/dev/null 2>&1 &
+	server=$!
+	for _ in $(seq 50); do
+		python3 -c "import urllib.request; urllib.request.urlopen('http://127.0.0.1:${port}/')" \
+			2>/dev/null && break
+		sleep 0.1
+	done
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--srpm-base-url "http://127.0.0.1:${port}/" \
+		--state-file "${STATE_FILE}"
+	kill "${server}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Would submit hwloc-ohpc-2.14.0-420.ohpc.2.1.src.rpm to test/project from http://127.0.0.1:${port}/hwloc-ohpc-2.14.0-420.ohpc.2.1.src.rpm"* ]]
+
+	# Without the server the SRPMs are uploaded instead
+	rm -f "${STATE_FILE}"
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--srpm-base-url "http://127.0.0.1:${port}/" \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"is not reachable"*"uploading instead"* ]]
+	[[ "$output" == *"Would submit hwloc-ohpc-2.14.0-420.ohpc.2.1.src.rpm to test/project"$'\n'* ]]
+}
+
+@test "srpm-base-url must be an http URL" {
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--srpm-base-url "/srv/repo" \
+		--state-file "${STATE_FILE}"
+	[ "$status" -ne 0 ]
+	[[ "$output" == *"--srpm-base-url must be an http:// or https:// URL"* ]]
+}
+
+@test "metrics-file receives Prometheus metrics" {
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--skip-pattern "^R-" \
+		--metrics-file "${TEST_DIR}/copr_bridge.prom" \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+
+	grep -qx "# TYPE copr_bridge_queue_depth gauge" "${TEST_DIR}/copr_bridge.prom"
+	grep -qx "copr_bridge_queue_depth 0.0" "${TEST_DIR}/copr_bridge.prom"
+	grep -qx "copr_bridge_inflight_builds 0.0" "${TEST_DIR}/copr_bridge.prom"
+	grep -qx 'copr_bridge_skipped_total{reason="dry-run"} 5.0' "${TEST_DIR}/copr_bridge.prom"
+	grep -qx 'copr_bridge_skipped_total{reason="filtered"} 1.0' "${TEST_DIR}/copr_bridge.prom"
+}
+
+@test "repeated chroot builds only the chroots still missing" {
+	cat >"${STATE_FILE}" <<-'EOF'
+		{
+		  "version": 1,
+		  "srpm_dir": "/tmp",
+		  "copr_project": "test/project",
+		  "chroot": "rhel+epel-10-ppc64le",
+		  "chroots": ["rhel+epel-10-ppc64le", "rhel+epel-9-ppc64le"],
+		  "builds": {
+		    "hwloc-ohpc-2.14.0-420.ohpc.2.1.src.rpm": {
+		      "status": "failed",
+		      "copr_build_id": 99999,
+		      "mtime": 1000000,
+		      "chroots": {
+		        "rhel+epel-10-ppc64le": "succeeded",
+		        "rhel+epel-9-ppc64le": "failed"
+		      }
+		    }
+		  },
+		  "last_succeeded": null,
+		  "blocked_on": "hwloc-ohpc-2.14.0-420.ohpc.2.1.src.rpm"
+		}
+	EOF
+
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--chroot rhel+epel-9-ppc64le \
+		--dry-run \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Building hwloc-ohpc-2.14.0-420.ohpc.2.1.src.rpm only for rhel+epel-9-ppc64le"* ]]
+	[[ "$output" == *"Would submit ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm"* ]]
+	[[ "$output" != *"Building ohpc-filesystem"* ]]
+}
+
+@test "chroots added to a pipeline get builds of already built SRPMs" {
+	fake_dir=$(mktemp -d)
+	make_srpm "${fake_dir}/lib-ohpc-2.0-1.src.rpm" lib-ohpc 2.0 1
+
+	run python3 "${FAKE_COPR}" --builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Build succeeded: lib-ohpc-2.0-1.src.rpm"* ]]
+
+	run python3 "${FAKE_COPR}" --builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--chroot rhel+epel-9-ppc64le \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *"Building lib-ohpc-2.0-1.src.rpm only for rhel+epel-9-ppc64le"* ]]
+	[[ "$output" == *"API calls: create_from_file=1,"* ]]
+
+	# Both chroots are built now
+	run python3 "${FAKE_COPR}" --builds-file "${TEST_DIR}/builds.json" -- \
+		--srpm-dir "${fake_dir}" \
+		${COMMON_ARGS} \
+		--chroot rhel+epel-9-ppc64le \
+		--poll-interval 1 \
+		--state-file "${STATE_FILE}"
+	rm -rf "${fake_dir}"
+	[ "$status" -eq 0 ]
+	[[ "$output" != *"create_from_file"* ]]
+	python3 -c "
+import json
+entry = json.load(open('${STATE_FILE}'))['builds']['lib-ohpc-2.0-1.src.rpm']
+assert entry['chroots'] == {
+    'rhel+epel-10-ppc64le': 'succeeded',
+    'rhel+epel-9-ppc64le': 'succeeded',
+}, entry
+"
+}
+
+@test "daemon mode watches every pipeline of the config file" {
+	second_dir="${TEST_DIR}/second"
+	mkdir "${second_dir}"
+	touch "${second_dir}/second-ohpc-1.0-1.src.rpm"
+	cat >"${TEST_DIR}/pipelines.json" <<-EOF
+		{
+		  "max_inflight": 2,
+		  "pipelines": [
+		    {
+		      "srpm_dir": "${TEST_DIR}",
+		      "copr_project": "test/project",
+		      "state_file": "${STATE_FILE}"
+		    },
+		    {
+		      "srpm_dir": "${second_dir}",
+		      "copr_project": "test/second",
+		      "chroot": "rhel+epel-9-ppc64le",
+		      "state_file": "${TEST_DIR}/second.json"
+		    }
+		  ]
+		}
+	EOF
+
+	python3 "${SCRIPT}" \
+		--mode daemon \
+		--config "${TEST_DIR}/pipelines.json" \
+		--dry-run >"${TEST_DIR}/daemon.log" 2>&1 &
+	pid=$!
+	for _ in $(seq 50); do
+		[ "$(grep -c "Watching" "${TEST_DIR}/daemon.log")" -eq 2 ] && break
+		sleep 0.1
+	done
+	touch "${second_dir}/late-ohpc-1.0-1.src.rpm"
+	for _ in $(seq 50); do
+		grep -q "Would submit late-ohpc" "${TEST_DIR}/daemon.log" && break
+		sleep 0.1
+	done
+	kill -TERM "${pid}"
+	wait "${pid}"
+
+	grep -q "Would submit ohpc-filesystem-4.2-420.ohpc.1.1.src.rpm to test/project" "${TEST_DIR}/daemon.log"
+	grep -q "Would submit second-ohpc-1.0-1.src.rpm to test/second" "${TEST_DIR}/daemon.log"
+	grep -q "Would submit late-ohpc-1.0-1.src.rpm to test/second" "${TEST_DIR}/daemon.log"
+	[ -f "${TEST_DIR}/second.json" ]
+}
+
+@test "daemon mode serves the metrics of all pipelines on one port" {
+	second_dir="${TEST_DIR}/second"
+	mkdir "${second_dir}"
+	touch "${second_dir}/second-ohpc-1.0-1.src.rpm"
+	cat >"${TEST_DIR}/pipelines.json" <<-EOF
+		{
+		  "pipelines": [
+		    {
+		      "srpm_dir": "${TEST_DIR}",
+		      "copr_project": "test/project",
+		      "state_file": "${STATE_FILE}"
+		    },
+		    {
+		      "srpm_dir": "${second_dir}",
+		      "copr_project": "test/second",
+		      "state_file": "${TEST_DIR}/second.json"
+		    }
+		  ]
+		}
+	EOF
+	port=$(python3 -c "
+import socket
+s = socket.socket()
+s.bind(('127.0.0.1', 0))
+print(s.getsockname()[1])
+")
+
+	python3 "${SCRIPT}" \
+		--mode daemon \
+		--config "${TEST_DIR}/pipelines.json" \
+		--metrics-port "${port}" \
+		--dry-run >"${TEST_DIR}/daemon.log" 2>&1 &
+	pid=$!
+	for _ in $(seq 50); do
+		[ "$(grep -c "Watching" "${TEST_DIR}/daemon.log")" -eq 2 ] && break
+		sleep 0.1
+	done
+	run python3 -c "
+import urllib.request
+print(urllib.request.urlopen('http://127.0.0.1:${port}/metrics').read().decode())
+"
+	kill -TERM "${pid}"
+	wait "${pid}"
+	[ "$status" -eq 0 ]
+	[[ "$output" == *'copr_bridge_skipped_total{copr_project="test/project",srpm_dir="'"${TEST_DIR}"'",reason="dry-run"} 6.0'* ]]
+	[[ "$output" == *'copr_bridge_skipped_total{copr_project="test/second",srpm_dir="'"${second_dir}"'",reason="dry-run"} 1.0'* ]]
+	[ "$(echo "$output" | grep -c "^# TYPE copr_bridge_queue_depth")" -eq 1 ]
+}
+
+@test "metrics label values are escaped and busy ports are rejected" {
+	run python3 -c '
+import sys
+sys.path.insert(0, "ansible/roles/obs/files")
+import copr_bridge
+metrics = copr_bridge.Metrics(labels=(("srpm_dir", "/a\\b\"c\nd"),))
+metrics.inc("copr_bridge_skipped_total", reason="dry-run")
+print(metrics.render())
+'
+	[ "$status" -eq 0 ]
+	[[ "$output" == *'copr_bridge_skipped_total{srpm_dir="/a\\b\"c\nd",reason="dry-run"} 1.0'* ]]
+
+	python3 -c "
+import socket
+import time
+s = socket.socket()
+s.bind(('127.0.0.1', 0))
+s.listen()
+print(s.getsockname()[1], flush=True)
+time.sleep(30)
+" >"${TEST_DIR}/port" &
+	holder=$!
+	for _ in $(seq 50); do
+		[ -s "${TEST_DIR}/port" ] && break
+		sleep 0.1
+	done
+	run python3 "${SCRIPT}" \
+		--srpm-dir "${TEST_DIR}" \
+		${COMMON_ARGS} \
+		--dry-run \
+		--metrics-port "$(cat "${TEST_DIR}/port")" \
+		--state-file "${STATE_FILE}"
+	kill "${holder}"
+	[ "$status" -ne 0 ]
+	[[ "$output" == *"Cannot serve metrics on port"* ]]
+	[[ "$output" != *"Traceback"* ]]
+}
+
+@test "daemon mode rejects pipelines sharing an SRPM directory" {
+	cat >"${TEST_DIR}/pipelines.json" <<-EOF
+		{
+		  "pipelines": [
+		    {
+		      "srpm_dir": "${TEST_DIR}",
+		      "copr_project": "test/project",
+		      "state_file": "${STATE_FILE}"
+		    },
+		    {
+		      "srpm_dir": "${TEST_DIR}/",
+		      "copr_project": "test/second",
+		      "state_file": "${TEST_DIR}/second.json"
+		    }
+		  ]
+		}
+	EOF
+
+	run python3 "${SCRIPT}" \
+		--mode daemon \
+		--config "${TEST_DIR}/pipelines.json" \
+		--dry-run
+	[ "$status" -ne 0 ]
+	[[ "$output" == *"must use distinct SRPM directories"* ]]
+}
+
+@test "daemon mode requires a config file" {
+	run python3 "${SCRIPT}" --mode daemon
+	[ "$status" -ne 0 ]
+	[[ "$output" == *"--mode daemon requires --config"* ]]
+}
@@ -14,6 +14,7 @@ import re
 import subprocess
 import sys
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from xml.etree import ElementTree
 
 import coloredlogs
@@ -29,6 +30,12 @@ skip_combos = ["arm1-impi", "arm1-mvapich2"]
 # osc command
 osc_command = ["osc", "-A", obsurl]
 
+# number of concurrent osc commands used for bulk lock/unlock
+bulk_osc_workers = 8
+
+# marker file added to new packages that are locked after creation
+markerFile = "_obs_config_ready_for_build"
+
 
 # Simple error wrapper to include exit
 def ERROR(output):
@@ -68,6 +75,8 @@ class ohpc_obs_tool(object):
         self.parentMPI = None
         self.dryRun = True
         self.buildsToCancel = []
+        self.lockRequests = {}
+        self.lockPool = None
         self.skip_on_distro = {}
 
         # parse version to derive obs-specific version info
@@ -668,7 +677,6 @@ class ohpc_obs_tool(object):
             fp = tempfile.NamedTemporaryFile(delete=False, mode="w+t")
             fp.flush()
 
-            markerFile = "_obs_config_ready_for_build"
             if self.dryRun:
                 logging.debug(
                     " " * pad
@@ -811,11 +819,29 @@ class ohpc_obs_tool(object):
             if not success:
                 ERROR("\nUnable to add _link file for package (%s) to OBS" % package)
 
-        # Step 3 - register package to lock build once it kicks off
+        # Step 3 - lock package right away (in the background) so OBS
+        # does not schedule builds while remaining packages are created.
+        # Locking must come last as locked packages reject source changes.
         self.buildsToCancel.append(package)
+        self.lockPackage(package)
+
+    # submit lock request for a newly created package to the bulk osc pool
+    def lockPackage(self, package):
+        if self.Lock is False:
+            return
+
+        if self.lockPool is None:
+            self.lockPool = ThreadPoolExecutor(max_workers=bulk_osc_workers)
+
+        self.lockRequests[package] = self.lockPool.submit(
+            run_osc_command,
+            ["lock", self.obsProject, package],
+            dry_run=self.dryRun,
+            fname="lockPackage",
+        )
 
+    # wait for outstanding lock requests of new packages
     def cancelNewBuilds(self):
-        fname = inspect.stack()[0][3]
         numBuilds = len(self.buildsToCancel)
 
         if self.Lock is False:
@@ -827,22 +853,71 @@ class ohpc_obs_tool(object):
         else:
             logging.info("\n%i new build(s) need to be locked:" % numBuilds)
             logging.info(
-                "--> will lock for now and GitHub"
+                "--> locked after creation and GitHub"
                 + " trigger will unlock on first commit"
             )
 
+        failed = []
         for package in self.buildsToCancel:
             if self.dryRun:
                 logging.info("--> (dryrun) requesting lock for package: %s" % package)
 
+            success, _ = self.lockRequests[package].result()
+            if not success:
+                failed.append(package)
+
+        self.lockPool.shutdown()
+        self.lockPool = None
+
+        if failed:
+            ERROR("\nUnable to lock package(s) in OBS: %s" % ", ".join(failed))
+
+    # unlock packages previously locked by this tool (e.g. when
+    # releasing a version) and remove their marker files. Packages
+    # without marker file are left untouched. Return: list of
+    # packages that failed to unlock
+    def unlockPackages(self, packages):
+        fname = inspect.stack()[0][3]
+
+        def unlock(package):
+            success, output = run_osc_command(
+                ["list", self.obsProject, package], dry_run=False, fname=fname
+            )
+            if not success:
+                return False
+            if markerFile not in output.decode():
+                logging.debug("[%s]: no lock marker for %s" % (fname, package))
+                return True
+
+            if self.dryRun:
+                logging.info("--> (dryrun) requesting unlock for package: %s" % package)
+            else:
+                logging.info("--> unlocking package: %s" % package)
+
             success, _ = run_osc_command(
-                ["lock", self.obsProject, package],
+                [
+                    "unlock",
+                    self.obsProject,
+                    package,
+                    "-m",
+                    "obs_config: releasing locked build",
+                ],
                 dry_run=self.dryRun,
                 fname=fname,
             )
-
             if not success:
-                ERROR("\nUnable to add _link file for package (%s) to OBS" % package)
+                return False
+
+            success, _ = run_osc_command(
+                ["rremove", "-f", self.obsProject, package, markerFile],
+                dry_run=self.dryRun,
+                fname=fname,
+            )
+            return success
+
+        with ThreadPoolExecutor(max_workers=bulk_osc_workers) as pool:
+            results = pool.map(unlock, packages)
+            return [p for p, success in zip(packages, results) if not success]
 
 
 # top-level
@@ -869,6 +944,12 @@ def main():
         help="do not lock new build additions",
         action="store_false",
     )
+    parser.add_argument(
+        "--unlock",
+        dest="unlock",
+        help="unlock all packages locked by a previous run and exit",
+        action="store_true",
+    )
     parser.add_argument(
         "--package", help="check OBS config for provided package only", type=str
     )
@@ -886,6 +967,7 @@ def main():
 
     parser.set_defaults(dryrun=True)
     parser.set_defaults(lock=True)
+    parser.set_defaults(unlock=False)
     args = parser.parse_args()
 
     def loglevel(debug):
@@ -923,6 +1005,17 @@ def main():
     # query components defined in existing OBS project
     obsPackages = obs.queryOBSPackages()
 
+    # release locks of previously added packages if requested
+    if args.unlock:
+        packages = list(obsPackages)
+        if args.package:
+            packages = [p for p in packages if p.startswith(args.package)]
+        logging.info("\nchecking %i package(s) for locks" % len(packages))
+        failed = obs.unlockPackages(packages)
+        if failed:
+            ERROR("\nUnable to unlock package(s) in OBS: %s" % ", ".join(failed))
+        return
+
     # Check if desired package(s) are present in OBS and add them if
     # not. Different logic applies to (1) standalone packages,
     # (2) packages with a compiler dependency, and (3) packages with an